@@ -12,20 +12,31 @@
 # obs: Very messy script!
 #
 
+import os
 import re
 import sys
-import httplib2
+import time
+import random
+import fnmatch
+import unicodedata
+import sqlite3
 import argparse
-from urllib import request, parse
+import threading
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from html import unescape
+from http import client as httpclient
+from urllib import parse
 
-from gscholar import query
 from bs4 import BeautifulSoup
 
 
 def parse_args(arglist):
     """Parse options with argparse."""
     usage = """\nUsage: %(prog)s doinumber > ref.bib\n
-    e.g.: %(prog)s -m ADS "10.1016/j.ocemod.2003.12.003" """
+    e.g.: %(prog)s -m ADS "10.1016/j.ocemod.2003.12.003"
+          %(prog)s -f dois.txt -o refs.bib
+          %(prog)s -s papers/ -o refs.bib """
 
     description = "Search bibtex reference using the doi"
 
@@ -33,13 +44,74 @@ def parse_args(arglist):
                                      description=description)
     parser.add_argument('positional',
                         metavar='doi',
+                        nargs='?',
                         help='e.g.: "10.1016/j.ocemod.2003.12.003"')
+    parser.add_argument('-f', '--file',
+                        dest='file',
+                        help="batch mode: file with one doi per line "
+                             "('-' for stdin)")
+    parser.add_argument('-s', '--search',
+                        dest='search',
+                        nargs='+',
+                        help="batch mode: resolve all dois found in text "
+                             "files (e.g. pdftotext output) or directories "
+                             "of *.txt files")
+    parser.add_argument('-b', '--bib',
+                        dest='bib',
+                        help="batch mode: existing .bib file; its dois are "
+                             "not looked up again and the output has its "
+                             "(deduplicated) entries too")
+    parser.add_argument('-o', '--output',
+                        dest='output',
+                        help="batch mode: output .bib file, default=stdout")
+    parser.add_argument('-j', '--jobs',
+                        dest='jobs',
+                        type=int,
+                        default=8,
+                        help="batch mode: concurrent lookups, default=8")
     parser.add_argument('-v', '--verbose',
                         dest="verbose",
                         default=False,
                         action="store_true",
                         help="increase verbosity, default=False")
 
+    parser.add_argument('-g', '--gscholar',
+                        dest='gscholar',
+                        default=False,
+                        action="store_true",
+                        help="try Google Scholar when a doi cannot be "
+                             "resolved, default=False")
+    parser.add_argument('--rate',
+                        dest='rate',
+                        type=float,
+                        default=5,
+                        help="requests per second per host, default=5")
+    parser.add_argument('--timeout',
+                        dest='timeout',
+                        type=float,
+                        default=30,
+                        help="seconds before a request times out, "
+                             "default=30")
+    parser.add_argument('--retries',
+                        dest='retries',
+                        type=int,
+                        default=3,
+                        help="retries of failed requests, default=3")
+    parser.add_argument('--cache',
+                        dest='cache',
+                        default=default_cache(),
+                        help="lookup cache file, default=%(default)s")
+    parser.add_argument('--ttl',
+                        dest='ttl',
+                        type=float,
+                        default=30,
+                        help="days before cached lookups expire, default=30")
+    parser.add_argument('--no-cache',
+                        dest='no_cache',
+                        default=False,
+                        action="store_true",
+                        help="do not read or write the lookup cache")
+
     group = parser.add_mutually_exclusive_group()
 
     group.add_argument('-m', '--method',
@@ -48,61 +120,472 @@ def parse_args(arglist):
                        default='CrossRef',
                        help="ADS, PANGAEA, GSCHOLAR, and CrossRef.")
 
-    args = parser.parse_args()
+    args = parser.parse_args(arglist)
+    if not (args.positional or args.file or args.search):
+        parser.error('a doi, a file of dois (-f) or files to search (-s) '
+                     'is required')
 
     return args
 
 
-def search_doi(text):
-    """Return a list with doi numbers found in a text.
-    stackoverflow.com/questions/27910/finding-a-doi-in-a-document-or-page
-    TODO: This is unfinished. I want to scrap a pdftotext output from a paper
-    and get all DOIs found.
-    """
-    dval = re.compile(r'10.(\d)+/(\S)+')
-    # Good for web scrapping
-    dval = re.compile(r'(10.(\d)+/([^(\s\>\"\<)])+)')
-    doi = dval.findall(dval)
+# stackoverflow.com/questions/27910/finding-a-doi-in-a-document-or-page
+# Dois have no white space; quotes and <> end them when web scrapping,
+# except in the <0041:MTPOAA> parts of SICI dois (old AMS papers).
+DOI_PATTERN = re.compile(r'\b10\.\d{4,9}/(?:[^\s"<>]|<\d+:[^\s"<>]+>)+')
+
+
+def _clean_doi(doi):
+    """Strip trailing punctuation and unbalanced closing brackets."""
+    while doi:
+        if doi[-1] in '.,;:\'':
+            doi = doi[:-1]
+        elif doi[-1] in ')]}' and doi.count(doi[-1]) > doi.count(
+                {')': '(', ']': '[', '}': '{'}[doi[-1]]):
+            doi = doi[:-1]
+        else:
+            break
     return doi
 
 
+def search_doi(text):
+    """Return a list with the (normalised, unique) doi numbers found in a
+    text, e.g. the pdftotext output of a paper."""
+    return list(iter_dois([text]))
+
+
+def iter_dois(chunks, seen=None, maxlen=1024):
+    """Yield the new (normalised) dois found in an iterable of text chunks,
+    such as a file read in blocks. Dois split between chunks are found:
+    text after the last white space of a chunk is carried over to the next
+    (at most maxlen characters). seen is the set of dois already found."""
+    if seen is None:
+        seen = set()
+    carry = ''
+    for chunk in chunks:
+        text = carry + chunk
+        cut = max(text.rfind(' '), text.rfind('\n'), text.rfind('\t'),
+                  text.rfind('\r')) + 1
+        if cut == 0:
+            cut = max(0, len(text) - maxlen)
+        text, carry = text[:cut], text[cut:]
+        for doi in _new_dois(text, seen):
+            yield doi
+    for doi in _new_dois(carry, seen):
+        yield doi
+
+
+def _new_dois(text, seen):
+    """Yield the dois in text that are not in seen (and add them)."""
+    for match in DOI_PATTERN.finditer(text):
+        doi = normalize_doi(_clean_doi(match.group()))
+        if doi not in seen:
+            seen.add(doi)
+            yield doi
+
+
+def search_files(paths, pattern='*.txt', chunksize=2**20):
+    """Yield the unique dois found in files, or in the files matching
+    pattern under directories, reading chunksize characters at a time."""
+    seen = set()
+    for filename in _walk(paths, pattern):
+        with open(filename, encoding='utf-8', errors='replace') as f:
+            chunks = iter(lambda: f.read(chunksize), '')
+            for doi in iter_dois(chunks, seen=seen):
+                yield doi
+
+
+def _walk(paths, pattern):
+    """Yield files, and the files matching pattern under directories."""
+    for path in paths:
+        if not os.path.isdir(path):
+            yield path
+            continue
+        for root, dirs, files in os.walk(path):
+            dirs.sort()
+            for name in sorted(fnmatch.filter(files, pattern)):
+                yield os.path.join(root, name)
+
+
+def normalize_doi(doi):
+    """Return doi without doi: or resolver url prefixes, in lower case
+    (dois are case insensitive)."""
+    doi = re.sub(r'^\s*(doi:\s*|https?://(dx\.)?doi\.org/)', '', doi,
+                 flags=re.IGNORECASE)
+    return doi.strip().lower()
+
+
+Response = namedtuple('Response', 'url status headers body')
+
+
+class HTTPError(IOError):
+    """The server answered with an HTTP error status."""
+    def __init__(self, status, url):
+        IOError.__init__(self, "HTTP %d: %s" % (status, url))
+        self.status = status
+        self.url = url
+
+
+class TokenBucket(object):
+    """Allow rate requests per second on average, in bursts of at most
+    burst requests. Safe to share between threads."""
+    def __init__(self, rate, burst=1):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """Take a token, waiting for it if needed."""
+        with self._lock:
+            now = time.monotonic()
+            self.tokens = min(self.burst,
+                              self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            self.tokens -= 1
+            wait = -self.tokens / self.rate if self.tokens < 0 else 0
+        if wait:
+            time.sleep(wait)
+
+
+class HTTPClient(object):
+    """Minimal HTTP(S) client shared by all the lookups:
+        keeps one keep-alive connection per host (and thread),
+        follows redirects,
+        limits requests per host with a TokenBucket (rate per second, or
+        rates[host]),
+        times out connections after timeout seconds,
+        retries connection errors and 429/5xx answers up to retries times,
+        with exponential backoff (or the server's Retry-After),
+        counts requests, errors, retries and latency per host (stats)."""
+    retry_status = (429, 500, 502, 503, 504)
+
+    def __init__(self, timeout=30, max_redirects=10, retries=3, backoff=1.0,
+                 max_backoff=60.0, rate=5.0, burst=5, rates=None):
+        self.timeout = timeout
+        self.max_redirects = max_redirects
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.rate = rate
+        self.burst = burst
+        self.rates = rates or {}
+        self.headers = {'User-Agent': 'doi2bibtex'}
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._buckets = {}
+        self._stats = {}
+
+    def _bucket(self, host):
+        """Return the TokenBucket of host."""
+        with self._lock:
+            bucket = self._buckets.get(host)
+            if bucket is None:
+                rate = self.rates.get(host, self.rate)
+                bucket = self._buckets[host] = TokenBucket(rate, self.burst)
+            return bucket
+
+    def _count(self, host, seconds=0.0, **counts):
+        """Add latency seconds and counts to the stats of host."""
+        with self._lock:
+            stats = self._stats.setdefault(
+                host, dict(requests=0, errors=0, retries=0, seconds=0.0))
+            stats['seconds'] += seconds
+            for k, v in counts.items():
+                stats[k] += v
+
+    def stats(self):
+        """Return {host: dict(requests, errors, retries, seconds,
+        mean_latency)}."""
+        with self._lock:
+            stats = dict((host, dict(s)) for host, s in self._stats.items())
+        for s in stats.values():
+            s['mean_latency'] = s['seconds'] / max(s['requests'], 1)
+        return stats
+
+    def _connection(self, scheme, netloc, new=False):
+        """Return the connection of this thread to scheme://netloc."""
+        connections = self._local.__dict__.setdefault('connections', {})
+        conn = connections.get((scheme, netloc))
+        if conn is None or new:
+            if conn is not None:
+                conn.close()
+            if scheme == 'https':
+                conn = httpclient.HTTPSConnection(netloc,
+                                                  timeout=self.timeout)
+            else:
+                conn = httpclient.HTTPConnection(netloc,
+                                                 timeout=self.timeout)
+            connections[(scheme, netloc)] = conn
+        return conn
+
+    def _send(self, url, headers):
+        """Make one GET request, retrying once on a stale connection."""
+        parts = parse.urlsplit(url)
+        path = parts.path or '/'
+        if parts.query:
+            path += '?' + parts.query
+        conn = self._connection(parts.scheme, parts.netloc)
+        while True:
+            reused = getattr(conn, 'used', False)
+            self._bucket(parts.netloc).acquire()
+            start = time.monotonic()
+            try:
+                conn.request('GET', path, headers=headers)
+                response = conn.getresponse()
+                body = response.read()
+            except (httpclient.HTTPException, OSError):
+                conn.close()
+                self._count(parts.netloc, time.monotonic() - start,
+                            requests=1, errors=1)
+                if not reused:
+                    raise
+                # The server may have closed the idle keep-alive
+                # connection: try once more on a new one.
+                conn = self._connection(parts.scheme, parts.netloc, new=True)
+                continue
+            errors = 1 if response.status >= 400 else 0
+            self._count(parts.netloc, time.monotonic() - start, requests=1,
+                        errors=errors)
+            conn.used = True
+            return response, body
+
+    def _delay(self, attempt, response=None):
+        """Return the seconds to wait before retry number attempt."""
+        if response is not None:
+            try:
+                return min(float(response.getheader('retry-after')),
+                           self.max_backoff)
+            except (TypeError, ValueError):
+                pass
+        delay = min(self.backoff * 2**attempt, self.max_backoff)
+        return delay * random.uniform(0.5, 1.0)
+
+    def _retry(self, url, headers):
+        """_send with retries of connection errors and 429/5xx answers."""
+        host = parse.urlsplit(url).netloc
+        for attempt in range(self.retries + 1):
+            last = attempt == self.retries
+            try:
+                response, body = self._send(url, headers)
+            except (httpclient.HTTPException, OSError):
+                if last:
+                    raise
+                response = None
+            else:
+                if response.status not in self.retry_status or last:
+                    return response, body
+            self._count(host, retries=1)
+            time.sleep(self._delay(attempt, response))
+
+    def request(self, url, headers=None):
+        """GET url, following redirects, and return a Response."""
+        hdrs = dict(self.headers)
+        hdrs.update(headers or {})
+        for k in range(self.max_redirects + 1):
+            response, body = self._retry(url, hdrs)
+            location = response.getheader('location')
+            if response.status in (301, 302, 303, 307, 308) and location:
+                url = parse.urljoin(url, location)
+                continue
+            headers = dict((k.lower(), v) for k, v in response.getheaders())
+            return Response(url, response.status, headers, body)
+        raise IOError("Too many redirects: %s" % url)
+
+    def get(self, url, headers=None):
+        """Same as request, but raise HTTPError on HTTP errors."""
+        response = self.request(url, headers=headers)
+        if response.status >= 400:
+            raise HTTPError(response.status, response.url)
+        return response
+
+    def close(self):
+        """Close the connections of this thread."""
+        connections = self._local.__dict__.pop('connections', {})
+        for conn in connections.values():
+            conn.close()
+
+
+def default_cache():
+    """Return the default path of the lookup cache."""
+    cachedir = os.environ.get('XDG_CACHE_HOME',
+                              os.path.join(os.path.expanduser('~'), '.cache'))
+    return os.path.join(cachedir, 'doi2bibtex.sqlite')
+
+
+CacheEntry = namedtuple('CacheEntry', 'bibtex status url fetched expired')
+
+
+class Cache(object):
+    """On-disk (SQLite) cache of lookups keyed by normalised doi and method.
+    Failures are cached too (bibtex None), for a shorter negative_ttl.
+    Beyond max_entries or max_bytes of bibtex, the least recently used
+    entries are evicted. Safe to share between threads."""
+    def __init__(self, path=None, ttl=30 * 86400, negative_ttl=86400,
+                 max_entries=100000, max_bytes=64 * 2**20):
+        self.path = path or default_cache()
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        dirname = os.path.dirname(self.path)
+        if dirname and not os.path.isdir(dirname):
+            os.makedirs(dirname)
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(self.path, timeout=30,
+                                   check_same_thread=False)
+        with self._db:
+            self._db.execute("""CREATE TABLE IF NOT EXISTS lookups (
+                doi TEXT, method TEXT, bibtex TEXT, status INTEGER,
+                url TEXT, fetched REAL, accessed REAL, size INTEGER,
+                PRIMARY KEY (doi, method))""")
+            self._db.execute("""CREATE INDEX IF NOT EXISTS lookups_accessed
+                ON lookups (accessed)""")
+
+    def lookup(self, doi, method):
+        """Return the CacheEntry of doi and method, or None."""
+        key = (normalize_doi(doi), method)
+        with self._lock, self._db:
+            row = self._db.execute("""SELECT bibtex, status, url, fetched
+                FROM lookups WHERE doi = ? AND method = ?""", key).fetchone()
+            if row is None:
+                return None
+            now = time.time()
+            self._db.execute("""UPDATE lookups SET accessed = ?
+                WHERE doi = ? AND method = ?""", (now,) + key)
+        bibtex, status, url, fetched = row
+        ttl = self.ttl if bibtex is not None else self.negative_ttl
+        return CacheEntry(bibtex, status, url, fetched, now - fetched > ttl)
+
+    def store(self, doi, method, bibtex, status=None, url=None):
+        """Cache bibtex (None for a failure) of doi and method."""
+        now = time.time()
+        size = len(bibtex) if bibtex else 0
+        with self._lock, self._db:
+            self._db.execute("""INSERT OR REPLACE INTO lookups
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?)""",
+                             (normalize_doi(doi), method, bibtex, status,
+                              url, now, now, size))
+            self._evict()
+
+    def _evict(self):
+        """Drop the least recently used entries beyond the limits."""
+        count, size = self._db.execute(
+            "SELECT COUNT(*), TOTAL(size) FROM lookups").fetchone()
+        if count <= self.max_entries and size <= self.max_bytes:
+            return
+        rows = self._db.execute(
+            "SELECT rowid, size FROM lookups ORDER BY accessed")
+        drop = []
+        for rowid, rowsize in rows:
+            if count <= self.max_entries and size <= self.max_bytes:
+                break
+            drop.append((rowid,))
+            count -= 1
+            size -= rowsize
+        self._db.executemany("DELETE FROM lookups WHERE rowid = ?", drop)
+
+    def __len__(self):
+        with self._lock:
+            return self._db.execute(
+                "SELECT COUNT(*) FROM lookups").fetchone()[0]
+
+    def clear(self):
+        """Remove all entries."""
+        with self._lock, self._db:
+            self._db.execute("DELETE FROM lookups")
+
+    def close(self):
+        self._db.close()
+
+
 class Bibtex(object):
     """ Convert doi number to bibtex entries."""
-    def __init__(self, doi=None, title=None):
+    # Backends (e.g. point them to a local stub server for testing).
+    resolver = "http://dx.doi.org/"
+    ads = "http://adsabs.harvard.edu/cgi-bin/"
+    pangaea = "http://doi.pangaea.de"
+    scholar = "https://scholar.google.com"
+    # HTTP errors meaning the doi is not there, cached as failures; other
+    # errors (e.g. 429/5xx still failing after the retries) are not cached.
+    missing_status = (404, 410)
+
+    def __init__(self, doi=None, title=None, client=None, cache=None):
         """
         Input doi number ou title (actually any text/keyword.)
         Returns doi, encoded doi, and doi url or just the title.
+        Lookups go through client (an HTTPClient), shared by batch runs,
+        and cache (a Cache) when given.
         """
-        _base_url = "http://dx.doi.org/"
         self.doi = doi
         self.title = title
         self.bibtex = None
+        self.response = None
+        self.client = client if client is not None else HTTPClient()
+        self.cache = cache
         if doi:
             self._edoi = parse.quote(doi)
-            self.url = _base_url + self._edoi  # Encoded doi.
+            self.url = self.resolver + self._edoi  # Encoded doi.
         else:
             self.url = None
 
     def validate_doi(self):
         """Validate doi number and return the url."""
-        # TODO: urllib2 does not redirect all possible doi(s).
-        # once I figure out why I'll eliminate httplib2.
-        h = httplib2.Http()
-        h.request(self.url, "GET")
-        req = httplib2.Http()
         try:
-            self.header, self.html = req.request(self.url, "GET")
-            self.paper_url = self.header['content-location']
+            response = self.client.request(self.url)
+            self.header, self.html = response.headers, response.body
+            self.paper_url = response.url
             return self.paper_url
         except Exception as e:
             print("Could not resolve doi url at: %s \n" % self.url)
             print('Error: %s\n' % str(e))
             return None
 
+    def _get(self, url, headers=None):
+        """GET url with the client and keep the response."""
+        self.response = self.client.get(url, headers=headers)
+        return self.response
+
+    def get(self, method):
+        """Get bibtex entry with method (CrossRef, ADS, PANGAEA or
+        GSCHOLAR), from the cache if it has a fresh entry; None if the
+        answer has no BibTeX entry. Only definitive answers are cached:
+        BibTeX, answers without it and missing_status errors. On other
+        errors (network, throttling, server errors) stale entries are used,
+        and the error is raised without them."""
+        fetch = getattr(self, 'get' + method)
+        if self.cache is None:
+            bibtex = fetch()
+            self.bibtex = bibtex if is_bibtex(bibtex) else None
+            return self.bibtex
+        entry = self.cache.lookup(self.doi, method)
+        if entry is not None and not entry.expired:
+            self.bibtex = entry.bibtex
+            return self.bibtex
+        self.response = None
+        status = None
+        try:
+            bibtex = fetch()
+        except (IOError, httpclient.HTTPException) as e:
+            if isinstance(e, HTTPError) and e.status in self.missing_status:
+                bibtex, status = None, e.status
+            elif entry is None or entry.bibtex is None:
+                raise
+            else:
+                self.bibtex = entry.bibtex
+                return self.bibtex
+        if self.response is not None:
+            status = self.response.status
+        url = self.response.url if self.response is not None else None
+        self.bibtex = bibtex if is_bibtex(bibtex) else None
+        self.cache.store(self.doi, method, self.bibtex, status=status,
+                         url=url)
+        return self.bibtex
+
     def _soupfy(self, url):
         """Returns a soup object."""
-        html = request.urlopen(url).read()
-        self.soup = BeautifulSoup(html)
+        html = self._get(url).body
+        self.soup = BeautifulSoup(html, 'html.parser')
         return self.soup
 
     def getCrossRef(self):
@@ -113,15 +596,16 @@ class Bibtex(object):
         """
         def format_bibtext(bibtext):
             """Quick-and-dirty formatting function."""
+            return normalize_bibtex(bibtext)
 
         headers = dict(Accept='text/bibliography; style=bibtex')
-        req = request.Request(self.url, headers=headers)
-        self.bibtex = request.urlopen(req).read().decode('utf-8')
+        response = self._get(self.url, headers=headers)
+        self.bibtex = format_bibtext(response.body.decode('utf-8'))
         return self.bibtex
 
     def getADS(self):
         """Get bibtex entry from doi using ADS database."""
-        uri = "http://adsabs.harvard.edu/cgi-bin/basic_connect?qsearch="
+        uri = self.ads + "basic_connect?qsearch="
         url = uri + self._edoi
 
         # Make soup and look for ADS bibcode.
@@ -129,34 +613,481 @@ class Bibtex(object):
         try:
             tag = soup.findAll('input', attrs={"name": "bibcode"})[0]
         except IndexError:
-            print("\nADS failed\n")
+            sys.stderr.write("\nADS failed\n\n")
         else:
-            bibcode = tag.get('value') if tag.get('value') else None
-            uri = 'http://adsabs.harvard.edu/cgi-bin/nph-bib_query?bibcode='
+            bibcode = tag.get('value')
+            if not bibcode:
+                sys.stderr.write("\nADS failed\n\n")
+                return None
+            uri = self.ads + 'nph-bib_query?bibcode='
             end = '&data_type=BIBTEX&db_key=AST%26nocookieset=1'
             url = uri + bibcode + end
-            bib = request.urlopen(url).read().decode('utf-8')
-            # Remove empty lines and query info.
-            bib = bib.split('\n')
-            self.bibtex = '\n'.join(bib[5:-1])
-        finally:
-            return self.bibtex
+            bib = self._get(url).body.decode('utf-8')
+            # Remove the query info before the entry.
+            start = bib.find('@')
+            if start >= 0:
+                self.bibtex = normalize_bibtex(bib[start:])
+        return self.bibtex
 
     def getPANGAEA(self):
         """Get bibtex entry from doi using PANGEA database
         doi example: 10.1594/PANGAEA.726855."""
-        uri = "http://doi.pangaea.de"
+        uri = self.pangaea
         url = uri + "/{}?format=citation_bibtex".format(self._edoi)
-        self.bibtex = request.urlopen(url).read().decode('utf-8')
+        self.bibtex = normalize_bibtex(self._get(url).body.decode('utf-8'))
         return self.bibtex
 
     def getGScholar(self):
-        """If you are feeling lucky."""
-        bibtex = query(self.doi, 4)[0]
-        self.bibtex = bibtex.decode('utf-8')
+        """If you are feeling lucky: BibTeX of the first Google Scholar
+        result for the doi (or title). Queried through the client like the
+        other backends (what the gscholar module does, with its BibTeX
+        cookie)."""
+        headers = {'Cookie': 'GSP=CF=4', 'User-Agent': 'Mozilla/5.0'}
+        url = self.scholar + '/scholar?q=' + parse.quote(self.doi or
+                                                         self.title)
+        response = self._get(url, headers=headers)
+        cookie = response.headers.get('set-cookie')
+        if cookie:
+            headers['Cookie'] += '; ' + cookie.split(';')[0]
+        links = _SCHOLAR_BIB.findall(response.body.decode('utf-8'))
+        if not links:
+            sys.stderr.write("\nGoogle Scholar failed\n\n")
+            return self.bibtex
+        url = parse.urljoin(response.url, unescape(links[0]))
+        bibtex = self._get(url, headers=headers).body.decode('utf-8')
+        self.bibtex = normalize_bibtex(bibtex)
         return self.bibtex
 
 
+_SCHOLAR_BIB = re.compile(r'<a href="([^"]*/scholar\.bib\?[^"]*)"')
+
+
+MONTHS = dict((m, m) for m in ('jan', 'feb', 'mar', 'apr', 'may', 'jun',
+                               'jul', 'aug', 'sep', 'oct', 'nov', 'dec'))
+FIELD_ORDER = ('author', 'editor', 'title', 'journal', 'booktitle', 'year',
+               'month', 'volume', 'number', 'pages', 'publisher', 'doi',
+               'url')
+STOPWORDS = frozenset('a an and as at by for from in of on the to with'
+                      .split())
+_ENTRY = re.compile(r'@\s*(\w+)\s*([{(])')
+_NAME = re.compile(r'\s*([^\s=,{}()"#]+)\s*')
+
+
+class BibEntry(object):
+    """A BibTeX entry.
+    Public data:
+        type = entry type (e.g. article)
+        key = citation key
+        fields = dictionary of fields, by lower case name"""
+    def __init__(self, type, key, fields):
+        self.type = type
+        self.key = key
+        self.fields = fields
+
+    @property
+    def doi(self):
+        """Normalised doi, or None."""
+        doi = self.fields.get('doi')
+        return normalize_doi(doi) if doi else None
+
+    def __repr__(self):
+        return 'BibEntry(%r, %r, %r)' % (self.type, self.key, self.fields)
+
+    def __str__(self):
+        names = [n for n in FIELD_ORDER if n in self.fields]
+        names += sorted(n for n in self.fields if n not in FIELD_ORDER)
+        lines = ['@%s{%s,' % (self.type, self.key)]
+        for name in names:
+            value = self.fields[name]
+            if not (name == 'month' and value in MONTHS):
+                value = '{%s}' % value
+            lines.append('  %s = %s,' % (name, value))
+        lines[-1] = lines[-1].rstrip(',')
+        return '\n'.join(lines) + '\n}'
+
+
+def parse_bibtex(text):
+    """Return the list of BibEntry in a BibTeX text, expanding @string
+    macros (and month names); @comment and @preamble are skipped.
+    Raises ValueError on malformed entries."""
+    entries = []
+    strings = dict(MONTHS)
+    pos = 0
+    while True:
+        match = _ENTRY.search(text, pos)
+        if match is None:
+            return entries
+        kind = match.group(1).lower()
+        close = '}' if match.group(2) == '{' else ')'
+        pos = match.end()
+        if kind in ('comment', 'preamble'):
+            pos = _skip(text, match.end(2) - 1)
+            continue
+        if kind == 'string':
+            name, value, pos = _field(text, pos, strings)
+            strings[name] = value
+            pos = _expect(text, pos, close)
+            continue
+        comma = text.find(',', pos)
+        end = text.find(close, pos)
+        if end >= 0 and (comma < 0 or end < comma):
+            # Entry without fields.
+            entries.append(BibEntry(kind, text[pos:end].strip(), {}))
+            pos = end + 1
+            continue
+        if comma < 0:
+            raise ValueError(_where(text, pos, "No citation key"))
+        key = text[pos:comma].strip()
+        pos = comma + 1
+        fields = {}
+        while True:
+            pos = _space(text, pos)
+            if text.startswith(close, pos):
+                pos += 1
+                break
+            name, value, pos = _field(text, pos, strings)
+            fields[name] = value
+            pos = _space(text, pos)
+            if text.startswith(',', pos):
+                pos += 1
+        entries.append(BibEntry(kind, key, fields))
+
+
+def _field(text, pos, strings):
+    """Parse name = value (# value ...) at pos."""
+    match = _NAME.match(text, pos)
+    if match is None or not text.startswith('=', match.end()):
+        raise ValueError(_where(text, pos, "Expected name = value"))
+    parts = []
+    pos = match.end()
+    while True:
+        pos = _space(text, pos + 1)
+        if text.startswith('{', pos):
+            end = _skip(text, pos)
+            parts.append(text[pos + 1:end - 1])
+        elif text.startswith('"', pos):
+            end = pos + 1
+            depth = 0
+            while end < len(text) and (text[end] != '"' or depth):
+                depth += {'{': 1, '}': -1}.get(text[end], 0)
+                end += 1
+            if end == len(text):
+                raise ValueError(_where(text, pos, "Unterminated string"))
+            parts.append(text[pos + 1:end])
+            end += 1
+        else:
+            word = _NAME.match(text, pos)
+            if word is None:
+                raise ValueError(_where(text, pos, "Expected a value"))
+            end = word.end()
+            value = word.group(1)
+            parts.append(strings.get(value.lower(), value))
+        pos = _space(text, end)
+        if not text.startswith('#', pos):
+            break
+    return match.group(1).lower(), ' '.join(''.join(parts).split()), pos
+
+
+def _skip(text, pos):
+    """Return the position after the brace group opened at pos."""
+    depth = 0
+    for end in range(pos, len(text)):
+        if text[end] == '{':
+            depth += 1
+        elif text[end] == '}':
+            depth -= 1
+            if not depth:
+                return end + 1
+    raise ValueError(_where(text, pos, "Unbalanced braces"))
+
+
+def _space(text, pos):
+    while pos < len(text) and text[pos].isspace():
+        pos += 1
+    return pos
+
+
+def _expect(text, pos, char):
+    pos = _space(text, pos)
+    if not text.startswith(char, pos):
+        raise ValueError(_where(text, pos, "Expected %r" % char))
+    return pos + 1
+
+
+def _where(text, pos, msg):
+    return "%s at line %d of BibTeX" % (msg, text.count('\n', 0, pos) + 1)
+
+
+def _ascii(text):
+    """Return the lower case letters and digits of a (La)TeX string."""
+    text = re.sub(r'\\[a-zA-Z]+|\\.', '', text)
+    text = unicodedata.normalize('NFKD', text)
+    return re.sub(r'[^a-z0-9]', '', text.lower())
+
+
+def make_key(entry):
+    """Return the citation key of an entry: last name of the first author,
+    year and first title word, e.g. fernandes2014python."""
+    names = entry.fields.get('author') or entry.fields.get('editor') or ''
+    first = re.split(r'\s+and\s+', names)[0]
+    if ',' in first:
+        last = first.split(',')[0]
+    else:
+        last = first.split()[-1] if first.split() else ''
+    year = re.sub(r'\D', '', entry.fields.get('year', ''))
+    words = [_ascii(w) for w in entry.fields.get('title', '').split()]
+    words = [w for w in words if w and w not in STOPWORDS]
+    key = _ascii(last) + year + (words[0] if words else '')
+    return key or 'anonymous'
+
+
+def normalize_entry(entry, rekey=True):
+    """Normalise an entry in place (field names, white space, doi, pages,
+    authors, month and, if rekey, the citation key) and return it."""
+    fields = {}
+    for name, value in entry.fields.items():
+        fields[name.lower()] = ' '.join(value.split())
+    if fields.get('doi'):
+        fields['doi'] = normalize_doi(fields['doi'])
+    if 'pages' in fields:
+        fields['pages'] = re.sub(r'\s*-+\s*', '--', fields['pages'])
+    for name in ('author', 'editor'):
+        if name in fields:
+            fields[name] = ' and '.join(re.split(r'\s+and\s+',
+                                                 fields[name]))
+    if 'month' in fields:
+        month = fields['month'][:3].lower()
+        if month in MONTHS:
+            fields['month'] = month
+    entry.type = entry.type.lower()
+    entry.fields = fields
+    if rekey:
+        entry.key = make_key(entry)
+    return entry
+
+
+def normalize_bibtex(text):
+    """Return BibTeX text with normalised entries and keys, or text as is
+    if it cannot be parsed."""
+    try:
+        entries = parse_bibtex(text)
+    except ValueError:
+        return text
+    if not entries:
+        return text
+    return '\n\n'.join(str(normalize_entry(e)) for e in entries)
+
+
+def is_bibtex(text):
+    """Return True if text has at least one BibTeX entry (backends may
+    answer with an HTML page instead)."""
+    if not text:
+        return False
+    try:
+        return bool(parse_bibtex(text))
+    except ValueError:
+        return False
+
+
+def merge_entries(entry, other):
+    """Add the fields of other missing in entry (entry wins) and return
+    entry."""
+    for name, value in other.fields.items():
+        if not entry.fields.get(name):
+            entry.fields[name] = value
+    return entry
+
+
+class Bibliography(object):
+    """Deduplicated collection of BibEntry: entries with the same doi (or,
+    without doi, the same title and year) are merged, using hash indices
+    instead of pairwise comparisons. Citation keys are unique."""
+    def __init__(self):
+        self.entries = []
+        self._dois = {}
+        self._titles = {}
+        self._keys = set()
+
+    def _title(self, entry):
+        return (_ascii(entry.fields.get('title', '')),
+                entry.fields.get('year'))
+
+    def add(self, entry, rekey=True):
+        """Normalise and add an entry, merging it into an existing one with
+        the same doi (or title and year). Keys of new entries are made by
+        make_key if rekey; returns the entry in the bibliography."""
+        normalize_entry(entry, rekey=rekey)
+        doi = entry.doi
+        if doi:
+            existing = self._dois.get(doi)
+        else:
+            existing = self._titles.get(self._title(entry))
+        if existing is not None:
+            return merge_entries(existing, entry)
+        key = base = entry.key
+        suffix = 0
+        while key in self._keys:
+            key = base + chr(ord('a') + suffix % 26) * (suffix // 26 + 1)
+            suffix += 1
+        entry.key = key
+        self._keys.add(key)
+        self.entries.append(entry)
+        if doi:
+            self._dois[doi] = entry
+        elif entry.fields.get('title'):
+            self._titles[self._title(entry)] = entry
+        return entry
+
+    def update(self, text, rekey=True):
+        """Add all entries of a BibTeX text and return the list of entries
+        in the bibliography they were added (or merged) to."""
+        return [self.add(entry, rekey=rekey) for entry in parse_bibtex(text)]
+
+    @classmethod
+    def read(cls, filename):
+        """Return the Bibliography of a .bib file, keeping its keys."""
+        bibliography = cls()
+        with open(filename, encoding='utf-8') as f:
+            bibliography.update(f.read(), rekey=False)
+        return bibliography
+
+    def __contains__(self, doi):
+        return normalize_doi(doi) in self._dois
+
+    def __iter__(self):
+        return iter(self.entries)
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __str__(self):
+        return '\n\n'.join(str(entry) for entry in self.entries)
+
+
+METHODS = ('CrossRef', 'ADS', 'PANGAEA')
+# Errors of a single lookup: network and HTTP errors, and answers that cannot
+# be decoded or parsed (UnicodeDecodeError is a ValueError).
+LOOKUP_ERRORS = (IOError, httpclient.HTTPException, ValueError)
+
+
+def resolve(doi, methods=METHODS, client=None, cache=None):
+    """Return (bibtex, method) for a doi, trying each method in turn
+    (PANGAEA first for PANGAEA dois) until one answers with BibTeX entries,
+    or (None, None) if all fail."""
+    bib = Bibtex(doi=doi, client=client, cache=cache)
+    if "PANGAEA" in doi.upper() and "PANGAEA" in methods:
+        methods = ["PANGAEA"] + [m for m in methods if m != "PANGAEA"]
+    for method in methods:
+        try:
+            bibtex = bib.get(method)
+        except LOOKUP_ERRORS:
+            bibtex = None
+        if is_bibtex(bibtex):
+            return bibtex, method
+        bib.bibtex = None
+    return None, None
+
+
+def resolve_all(dois, methods=METHODS, jobs=8, client=None, cache=None):
+    """Resolve many dois concurrently with a pool of jobs threads sharing
+    the keep-alive connections of client (and cache).
+    Yields (doi, bibtex, method) in the order of dois; (doi, None, None)
+    for dois that failed, whatever the error."""
+    dois = list(dois)
+    if client is None:
+        client = HTTPClient()
+
+    def work(doi):
+        try:
+            return resolve(doi, methods=methods, client=client, cache=cache)
+        except Exception as e:
+            # One bad answer must not abort the other lookups.
+            sys.stderr.write("Error resolving %s: %r\n" % (doi, e))
+            return None, None
+
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        for doi, (bibtex, method) in zip(dois, executor.map(work, dois)):
+            yield doi, bibtex, method
+
+
+def read_dois(fileobj):
+    """Return the dois of a file with one doi per line, skipping blank
+    lines and # comments."""
+    dois = []
+    for line in fileobj:
+        line = line.strip()
+        if line and not line.startswith('#'):
+            dois.append(line)
+    return dois
+
+
+def batch(args):
+    """Resolve the dois of args.file, or found in args.search files, into
+    args.output (.bib)."""
+    if args.search:
+        dois = search_files(args.search)
+    elif args.file == '-':
+        dois = read_dois(sys.stdin)
+    else:
+        with open(args.file) as f:
+            dois = read_dois(f)
+    # Each (normalised) doi once.
+    dois = list(dict.fromkeys(normalize_doi(doi) for doi in dois))
+    if args.bib:
+        bibliography = Bibliography.read(args.bib)
+        dois = [doi for doi in dois if doi not in bibliography]
+    else:
+        bibliography = Bibliography()
+    cache = open_cache(args)
+    client = open_client(args)
+    failed = 0
+    try:
+        for doi, bibtex, method in resolve_all(dois, jobs=args.jobs,
+                                               client=client, cache=cache):
+            if bibtex and bibliography.update(bibtex):
+                if args.verbose:
+                    sys.stderr.write("%s: %s\n" % (doi, method))
+            else:
+                failed += 1
+                sys.stderr.write("Unable to resolve: %s\n" % doi)
+    finally:
+        if cache is not None:
+            cache.close()
+        # Keep what was resolved, even if the run is interrupted.
+        write_bibliography(bibliography, args.output)
+    if args.verbose:
+        for host, stats in sorted(client.stats().items()):
+            sys.stderr.write("%s: %d requests, %d errors, %d retries, "
+                             "%.3f s mean latency\n" % (
+                                 host, stats['requests'], stats['errors'],
+                                 stats['retries'], stats['mean_latency']))
+    return 1 if failed else 0
+
+
+def write_bibliography(bibliography, filename=None):
+    """Write the entries of bibliography to filename (default stdout)."""
+    out = open(filename, 'w', encoding='utf-8') if filename else sys.stdout
+    try:
+        for entry in bibliography:
+            out.write(str(entry) + '\n\n')
+    finally:
+        if out is not sys.stdout:
+            out.close()
+
+
+def open_client(args):
+    """Return the HTTPClient of the command line arguments."""
+    return HTTPClient(timeout=args.timeout, retries=args.retries,
+                      rate=args.rate)
+
+
+def open_cache(args):
+    """Return the Cache of the command line arguments (or None)."""
+    if args.no_cache:
+        return None
+    return Cache(args.cache, ttl=args.ttl * 86400)
+
+
 def main(argv=None):
     """TODO: unittest with several doi searches."""
     if argv is None:
@@ -164,40 +1095,55 @@ def main(argv=None):
 
     args = parse_args(argv[1:])
 
+    if args.file or args.search:
+        return batch(args)
+
     doi = args.positional
     method = args.method
 
     def allfailed():
-        """All failed message+google try."""
+        """All failed message (+google try with --gscholar)."""
         bold, reset = "\033[1m", "\033[0;0m"
-        bib.getGScholar()
         # FIXME: Has no meaning when using title
         url = bold + bib.url + reset
         msg = """Unable to resolve this DOI using database
         \nTry opening, \n\t{0}\nand download it manually.
+        """.format(url)
+        if args.gscholar and method != "GSCHOLAR":
+            try:
+                bib.getGScholar()
+            except (IOError, httpclient.HTTPException) as e:
+                msg += """
+        \nGoogle Scholar search failed too: {0}
+        """.format(e)
+            else:
+                msg += """
         \n...or if you are lucky check the Google Scholar search below:
-        \n{1}
-        """.format(url, bib.bibtex)
+        \n{0}
+        """.format(bib.bibtex)
         return msg
 
     # Create the bib object.
-    bib = Bibtex(doi=doi)
+    bib = Bibtex(doi=doi, client=open_client(args), cache=open_cache(args))
 
     # Forces PANGAE if doi has the string? Or suggest it?
-    if (method == "PANGAEA") or ("PANGAEA" in doi):
-        print("\nPANGAEA\n")
-        bib.getPANGAEA()
-    elif method == "ADS":
-        print("\nADS\n")
-        bib.getADS()
-    elif method == "GSCHOLAR":
-        print("\nGSCHOLAR\n")
-        bib.getGScholar()
-    elif method == "CrossRef":
-        print("\nCrossRef\n")
-        bib.getCrossRef()
-    else:
-        print("Unrecognized method.")
+    try:
+        if (method == "PANGAEA") or ("PANGAEA" in doi):
+            print("\nPANGAEA\n")
+            bib.get("PANGAEA")
+        elif method == "ADS":
+            print("\nADS\n")
+            bib.get("ADS")
+        elif method == "GSCHOLAR":
+            print("\nGSCHOLAR\n")
+            bib.get("GScholar")
+        elif method == "CrossRef":
+            print("\nCrossRef\n")
+            bib.get("CrossRef")
+        else:
+            print("Unrecognized method.")
+    except (IOError, httpclient.HTTPException) as e:
+        sys.stderr.write("Error: %s\n" % e)
 
     # Check if successful and print bibtex.
     if bib.bibtex:
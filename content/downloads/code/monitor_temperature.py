@@ -1,12 +1,19 @@
 #!/usr/bin/env python3
 
 import os
+import re
 import sys
-from sh import sensors
-from time import sleep
+import glob
+import json
+import time
+import asyncio
+import argparse
+from concurrent.futures import ThreadPoolExecutor
 from tempfile import mktemp
 from urllib.request import build_opener
 
+import numpy as np
+
 # Speak params.
 mp3 = mktemp()
 opener = build_opener()
@@ -14,20 +21,100 @@ google_translate_url = 'http://translate.google.com/translate_tts'
 agent = 'Mozilla/4.0 (compatible; MSIE 6.0; Windows NT 5.0)'
 opener.addheaders = [('User-agent', agent)]
 
+HWMON = '/sys/class/hwmon'
+
+# One phrase at a time: speak writes the shared mp3 file.
+_speaker = ThreadPoolExecutor(max_workers=1)
+
+
+class HwmonReader(object):
+    """Read temperatures from the hwmon sysfs interface,
+    root/hwmon*/temp*_input (millidegrees Celsius), without forking
+    `sensors`. The files are opened once and re-read with os.pread.
+
+    Sensors are named by their temp*_label (e.g. 'Core 0'), prefixed by the
+    device when labels repeat. Only sensors whose label starts with one of
+    labels are read; all of them when none match (or labels is None)."""
+    def __init__(self, root=HWMON, labels=('Core',)):
+        self.root = root
+        self.fds = {}
+        sensors = []
+        inputs = glob.glob(os.path.join(root, '*', 'temp*_input'))
+        for path in sorted(inputs, key=_natural):
+            device = os.path.basename(os.path.dirname(path))
+            label = _read(path.replace('_input', '_label'))
+            if label is None:
+                name = _read(os.path.join(os.path.dirname(path), 'name'))
+                label = '%s %s' % (name or device,
+                                   os.path.basename(path)[:-len('_input')])
+            sensors.append((device, label, path))
+        if labels:
+            chosen = [s for s in sensors if s[1].startswith(tuple(labels))]
+            sensors = chosen or sensors
+        counts = {}
+        for device, label, path in sensors:
+            counts[label] = counts.get(label, 0) + 1
+        try:
+            for device, label, path in sensors:
+                if counts[label] > 1:
+                    label = '%s %s' % (device, label)
+                self.fds[label] = os.open(path, os.O_RDONLY)
+        except OSError:
+            self.close()
+            raise
+        if not self.fds:
+            raise IOError('No temperature sensors found in %s' % root)
+
+    def read(self):
+        """Return {sensor: temperature (degrees Celsius)}."""
+        temps = {}
+        for label, fd in self.fds.items():
+            try:
+                temps[label] = int(os.pread(fd, 32, 0)) / 1000.
+            except (OSError, ValueError):
+                # Sensors may fail transiently (e.g. device asleep).
+                continue
+        return temps
+
+    def close(self):
+        for fd in self.fds.values():
+            os.close(fd)
+        self.fds = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def _read(path):
+    """Return the stripped contents of a small file, or None."""
+    try:
+        with open(path) as f:
+            return f.read().strip()
+    except (IOError, OSError):
+        return None
+
 
-def parse_temps(line):
-    cut = slice(1, 5)
-    return float(line.split(':')[1].strip()[cut])
+def _natural(path):
+    """Sort key with numbers in numerical order (temp10 after temp9)."""
+    return [int(s) if s.isdigit() else s for s in re.split(r'(\d+)', path)]
 
 
-def get_temps():
-    res = sensors()
-    lines = res.stdout.decode(encoding='UTF-8').split('\n')
-    temps = []
-    for line in lines:
-        if 'Core' in line:
-            temps.append(parse_temps(line))
-    return max(temps)
+_reader = None
+
+
+def get_temps(reader=None):
+    """Return the maximum temperature of the sensors of reader (default a
+    HwmonReader of this machine, opened on first use), or None if none of
+    them could be read."""
+    global _reader
+    if reader is None:
+        if _reader is None:
+            _reader = HwmonReader()
+        reader = _reader
+    return max(reader.read().values(), default=None)
 
 
 def speak(phrase):
@@ -43,20 +130,324 @@ def speak(phrase):
         os.system('espeak "%s"' % phrase)
     return None
 
-def main():
-    while True:
-        sleep(2)
-        os.system('clear && sensors')
-        temp = get_temps()
-        phrase = None
-        if temp >= 94:
-            phrase = 'Temperature is %s' % temp
-        if temp > 96:
-            phrase = 'Turn off the computer before it blows up!'
-
-        if phrase:
-            speak(phrase)
-            sleep(1)
+
+class RingBuffer(object):
+    """Fixed-size, NumPy-backed history of readings of several sensors.
+    Public data:
+        labels = sensor of each column
+        times = sample times (seconds), in storage order
+        values = (capacity, sensors) temperatures, NaN where missing"""
+    def __init__(self, capacity=1800):
+        self.capacity = capacity
+        self.labels = []
+        self.times = np.full(capacity, np.nan)
+        self.values = np.full((capacity, 0), np.nan)
+        self.count = 0
+
+    def _column(self, label):
+        """Return the column of label, adding one for new sensors."""
+        try:
+            return self.labels.index(label)
+        except ValueError:
+            self.labels.append(label)
+            empty = np.full((self.capacity, 1), np.nan)
+            self.values = np.concatenate((self.values, empty), axis=1)
+            return len(self.labels) - 1
+
+    def append(self, when, temps):
+        """Add the readings {sensor: temperature} taken at time when."""
+        columns = [self._column(label) for label in temps]
+        row = self.count % self.capacity
+        self.times[row] = when
+        self.values[row] = np.nan
+        self.values[row, columns] = list(temps.values())
+        self.count += 1
+
+    def window(self, seconds=None):
+        """Return the times and values of the last seconds (all if None),
+        oldest first."""
+        n = min(self.count, self.capacity)
+        order = np.arange(self.count - n, self.count) % self.capacity
+        times, values = self.times[order], self.values[order]
+        if seconds is not None and n:
+            recent = times >= times[-1] - seconds
+            times, values = times[recent], values[recent]
+        return times, values
+
+    def stats(self, seconds=None):
+        """Return {sensor: (max, mean, trend)} over the last seconds,
+        trend being the least squares slope in degrees per second."""
+        times, values = self.window(seconds)
+        valid = np.isfinite(values)
+        count = valid.sum(axis=0)
+        if not len(times):
+            return {}
+        y = np.where(valid, values, 0.)
+        t = np.where(valid, (times - times[-1])[:, None], 0.)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            tm = t.sum(axis=0) / count
+            ym = y.sum(axis=0) / count
+            dt = np.where(valid, t - tm, 0.)
+            trend = (dt * (y - ym)).sum(axis=0) / (dt * dt).sum(axis=0)
+            vmax = np.where(valid, values, -np.inf).max(axis=0)
+        trend = np.where(count > 1, trend, np.nan)
+        return dict((label, (vmax[k], ym[k], trend[k]))
+                    for k, label in enumerate(self.labels) if count[k])
+
+
+class LocalSource(object):
+    """Readings of this machine (a HwmonReader)."""
+    def __init__(self, reader, name='localhost'):
+        self.reader = reader
+        self.name = name
+
+    async def read(self):
+        return self.reader.read()
+
+    def close(self):
+        self.reader.close()
+
+
+class RemoteSource(object):
+    """Readings of a remote agent (see serve_agent) at host:port, over a
+    kept-open TCP connection: each request line is answered with a JSON
+    line of {sensor: temperature}. After a failure the agent is not tried
+    again for backoff seconds, doubled on each failure up to max_backoff,
+    so that a dead agent does not cost a timeout on every reading."""
+    def __init__(self, host, port, timeout=5., backoff=2., max_backoff=60.):
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.name = '%s:%s' % (host, port)
+        self._streams = None
+        self._delay = 0.
+        self._retry = 0.
+
+    async def read(self):
+        """Return the readings, or None if the agent cannot be reached."""
+        if time.monotonic() < self._retry:
+            return None
+        try:
+            if self._streams is None:
+                self._streams = await asyncio.wait_for(
+                    asyncio.open_connection(self.host, self.port),
+                    self.timeout)
+            reader, writer = self._streams
+            writer.write(b'READ\n')
+            line = await asyncio.wait_for(reader.readline(), self.timeout)
+            if not line:
+                raise ConnectionError('Agent closed the connection')
+            temps = json.loads(line.decode('utf-8'))
+        except (OSError, asyncio.TimeoutError, ValueError):
+            self.close()
+            self._delay = min(max(2 * self._delay, self.backoff),
+                              self.max_backoff)
+            self._retry = time.monotonic() + self._delay
+            return None
+        self._delay = 0.
+        return temps
+
+    def close(self):
+        if self._streams is not None:
+            self._streams[1].close()
+            self._streams = None
+
+
+async def serve_agent(reader, host='0.0.0.0', port=8649):
+    """Serve the readings of reader (a HwmonReader) to RemoteSources.
+    Returns the asyncio server."""
+    async def handle(stream, writer):
+        try:
+            while await stream.readline():
+                writer.write(json.dumps(reader.read()).encode('utf-8') +
+                             b'\n')
+                await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+    return await asyncio.start_server(handle, host, port)
+
+
+class Collector(object):
+    """Poll many sources concurrently every interval seconds, keep their
+    history in a RingBuffer each and raise alerts:
+        warn = temperature to warn at (degrees)
+        critical = temperature to panic above (degrees)
+        rise = rate of rise (degrees per minute) over the last window
+               seconds to warn at, long before the thresholds; checked
+               once there are window/2 seconds of history, so that the
+               jitter of the first readings is not taken for a trend
+        repeat = seconds before the same alert of a source is raised again
+    Timeouts of the sources are capped at interval, so that a slow source
+    does not delay the polls of the others.
+    alert is called as alert(source name, kind, value) with kind 'warn',
+    'critical' or 'rise'."""
+    def __init__(self, sources, interval=2., capacity=1800, window=60.,
+                 warn=94, critical=96, rise=10., repeat=60., alert=None):
+        self.sources = sources
+        self.interval = interval
+        self.window = window
+        self.warn = warn
+        self.critical = critical
+        self.rise = rise
+        self.repeat = repeat
+        self.alert = alert or (lambda name, kind, value: None)
+        self.buffers = dict((s.name, RingBuffer(capacity)) for s in sources)
+        self._alerted = {}
+        for source in sources:
+            if getattr(source, 'timeout', None) is not None:
+                source.timeout = min(source.timeout, interval)
+
+    async def poll(self):
+        """Take one reading of all sources and check them."""
+        readings = await asyncio.gather(*[s.read() for s in self.sources])
+        now = time.time()
+        for source, temps in zip(self.sources, readings):
+            if temps:
+                self.buffers[source.name].append(now, temps)
+                self.check(source.name, temps)
+
+    def check(self, name, temps):
+        """Raise the alerts of the latest readings of source name."""
+        temp = max(temps.values())
+        if temp > self.critical:
+            self._alert(name, 'critical', temp)
+        elif temp >= self.warn:
+            self._alert(name, 'warn', temp)
+        buffer = self.buffers[name]
+        times = buffer.window(self.window)[0]
+        if times[-1] - times[0] < self.window / 2:
+            return
+        stats = buffer.stats(self.window)
+        trends = [s[2] for s in stats.values() if np.isfinite(s[2])]
+        if trends and max(trends) * 60 >= self.rise:
+            self._alert(name, 'rise', max(trends) * 60)
+
+    def _alert(self, name, kind, value):
+        """Call alert, unless it was called for name and kind less than
+        repeat seconds ago."""
+        now = time.time()
+        if now - self._alerted.get((name, kind), -np.inf) < self.repeat:
+            return
+        self._alerted[(name, kind)] = now
+        self.alert(name, kind, value)
+
+    def stats(self):
+        """Return {source name: RingBuffer.stats over the window}."""
+        return dict((name, buffer.stats(self.window))
+                    for name, buffer in self.buffers.items())
+
+    async def run(self, count=None, callback=None):
+        """Poll every interval seconds, count times (forever if None),
+        calling callback(self) after each poll."""
+        loop = asyncio.get_running_loop()
+        start = loop.time()
+        k = 0
+        while count is None or k < count:
+            await self.poll()
+            if callback is not None:
+                callback(self)
+            k += 1
+            # Keep a steady rate, whatever the time taken by the sources.
+            await asyncio.sleep(max(0, start + k * self.interval -
+                                    loop.time()))
+
+
+def show_stats(stats):
+    """Print the rolling statistics of Collector.stats on a cleared
+    terminal."""
+    lines = ['%-24s %8s %8s %10s' % ('', 'max', 'mean', 'C/minute')]
+    for name in sorted(stats):
+        lines.append(name)
+        for label, (vmax, mean, trend) in sorted(stats[name].items()):
+            lines.append('  %-22s %8.1f %8.1f %10.2f' % (label, vmax, mean,
+                                                         trend * 60))
+    sys.stdout.write('\033[H\033[2J' + '\n'.join(lines) + '\n')
+    sys.stdout.flush()
+
+
+def spoken_alert(name, kind, value):
+    """Speak an alert of a Collector, without blocking the event loop;
+    phrases are spoken one after the other."""
+    where = '' if name == 'localhost' else ' on %s' % name.split(':')[0]
+    if kind == 'critical':
+        phrase = 'Turn off the computer%s before it blows up!' % where
+    elif kind == 'warn':
+        phrase = 'Temperature%s is %s' % (where, value)
+    else:
+        phrase = 'Temperature%s rising %.0f degrees per minute' % (where,
+                                                                   value)
+    asyncio.get_running_loop().run_in_executor(_speaker, speak, phrase)
+
+
+def parse_args(arglist):
+    parser = argparse.ArgumentParser(
+        description='Speak up when the CPU gets too hot.')
+    parser.add_argument('-i', '--interval', type=float, default=2,
+                        help='seconds between readings, default=2')
+    parser.add_argument('--root', default=HWMON,
+                        help='hwmon sysfs directory, default=%(default)s')
+    parser.add_argument('--warn', type=float, default=94,
+                        help='temperature to speak at, default=94')
+    parser.add_argument('--critical', type=float, default=96,
+                        help='temperature to panic above, default=96')
+    parser.add_argument('--rise', type=float, default=10,
+                        help='degrees per minute to speak at, default=10')
+    parser.add_argument('--window', type=float, default=60,
+                        help='seconds of the rolling statistics, default=60')
+    parser.add_argument('--repeat', type=float, default=60,
+                        help='seconds before repeating an alert, default=60')
+    parser.add_argument('-r', '--remote', action='append', default=[],
+                        metavar='HOST:PORT',
+                        help='also monitor the agent at HOST:PORT')
+    parser.add_argument('--no-local', action='store_true',
+                        help='do not monitor this machine')
+    parser.add_argument('--agent', type=int, metavar='PORT',
+                        help='serve the readings of this machine on PORT '
+                             'instead of monitoring')
+    parser.add_argument('-q', '--quiet', action='store_true',
+                        help='do not print the temperatures')
+    return parser.parse_args(arglist)
+
+
+async def monitor(args):
+    """Run the agent, or the Collector, of the command line arguments."""
+    if args.agent:
+        with HwmonReader(args.root) as reader:
+            server = await serve_agent(reader, port=args.agent)
+            async with server:
+                await server.serve_forever()
+        return
+    sources = [] if args.no_local else [LocalSource(HwmonReader(args.root))]
+    for remote in args.remote:
+        host, port = remote.rsplit(':', 1)
+        sources.append(RemoteSource(host, int(port)))
+    collector = Collector(sources, interval=args.interval,
+                          window=args.window, warn=args.warn,
+                          critical=args.critical, rise=args.rise,
+                          repeat=args.repeat, alert=spoken_alert)
+
+    def display(collector):
+        show_stats(collector.stats())
+
+    try:
+        await collector.run(callback=None if args.quiet else display)
+    finally:
+        for source in sources:
+            source.close()
+
+
+def main(argv=None):
+    if argv is None:
+        argv = sys.argv
+    args = parse_args(argv[1:])
+    try:
+        asyncio.run(monitor(args))
+    except KeyboardInterrupt:
+        pass
 
 if __name__ == '__main__':
-    sys.exit(main())
+    sys.exit(main(sys.argv))
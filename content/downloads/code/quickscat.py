@@ -11,15 +11,22 @@ Terms of Data Use:
 http://www.remss.com/terms_of_data_use/terms_of_data_use.html
 """
 
+import os
+import re
 import sys
-import copy
+import glob
+import time
 import gzip
 import decimal
+import argparse
+import datetime
 import numpy as np
+from multiprocessing import Pool
 from operator import mul
-from functools import reduce
+from functools import reduce, lru_cache
 from collections import namedtuple
 from collections import OrderedDict
+from collections.abc import Mapping
 
 
 class Dataset(object):
@@ -28,10 +35,17 @@ class Dataset(object):
         filename = name of data file
         missing = fill value used for missing data;
                   if None, then fill with byte codes (251-255)
+        bbox = (lon0, lon1, lat0, lat1) of the decoded region, or None for
+               the whole grid
+        dtype = floating point type of the decoded variables
         dimensions = dictionary of dimensions for each coordinate
-        variables = dictionary of data for each variable
+        variables = mapping of data for each variable; each variable is
+                    decoded on first access and cached until dropped with
+                    variables.drop(var)
 
-    All classes derived from Dataset must implement the following:
+    All classes derived from Dataset must set filename and missing, and
+    may set bbox and dtype (default None and float64), before calling
+    Dataset.__init__. They must implement the following:
         _attributes() = returns list of attributes for each variable (list)
         _coordinates() = returns coordinates (tuple)
         _shape() = returns shape of raw data (tuple)
@@ -49,42 +63,65 @@ class Dataset(object):
         _get_scale(var) = returns bmap scale for var
         _get_offset(var) = returns bmap offset for var
     """
+    bbox = None
+    dtype = np.float64
 
     def __init__(self):
+        self._bad = None
+        self._window = self._get_window()
         self.dimensions = self._get_dimensions()
         self.variables = self._get_variables()
 
     def _default_get(self, var, bmap):
-        data = get_data(bmap, self._get_index(var))
-        acopy = copy.deepcopy(data)
-        bad = is_bad(data)
+        raw = bmap[..., self._get_index(var), :, :]
         try:
-            data *= self._get_scale(var)
+            data = np.multiply(raw, self._get_scale(var), dtype=self.dtype)
         except _NoValueFound:
-            pass
+            data = get_data(bmap, self._get_index(var), dtype=self.dtype)
         try:
             data += self._get_offset(var)
         except _NoValueFound:
             pass
+        # Bad cells are found (and restored) from the raw bytes directly.
         if not self.missing:
-            data[bad] = acopy[bad]
+            np.copyto(data, raw, where=is_bad(raw))
         else:
-            data[bad] = self.missing
+            np.copyto(data, self.missing, where=is_bad(raw))
         return data
 
+    def _cache(self):
+        return _classcache(self.__class__)
+
     def _dtype(self):
         return np.uint8
 
     def _get(self, var):
+        table = self._cache()['get']
         try:
-            return _get_(var, _from_=self)
-        except _NoMethodFound:
-            pass
+            get, method = table[var]
+        except KeyError:
+            get, method = table.setdefault(var, self._lookup(var))
+        if method:
+            return get.__get__(self)
+        return get
+
+    def _get_attributes(self, var):
+        """Return dictionary of attributes of var, built once per class."""
+        attributes = self._cache()['attributes']
         try:
-            return _get_(var, _from_=thismodule())
-        except _NoMethodFound:
+            return attributes[var]
+        except KeyError:
             pass
-        return self._default_get
+        attrs = OrderedDict((attr, _get_(attr, _from_=self)(var))
+                            for attr in self._attributes())
+        return attributes.setdefault(var, attrs)
+
+    def _get_bad(self, bmap):
+        """Return cached, read-only mask of cells without valid data."""
+        if self._bad is None:
+            self._bad = is_bad(bmap[..., 0, :, :])
+            self._bad.setflags(write=False)
+        return self._bad
 
     def _get_avariable(self, var, data):
         variable = self._get(var)(var, data)
@@ -100,24 +137,121 @@ class Dataset(object):
     def _get_dimensions(self):
         dims = OrderedDict(list(zip(self._coordinates(), self._shape())))
         del dims['variable']
+        rows, cols = self._window
+        dims['latitude'] = np.arange(dims['latitude'])[rows].size
+        dims['longitude'] = np.arange(dims['longitude'])[cols].size
         return dims
 
+    def _get_latitude(self, var, bmap):
+        lat = self._grid()[0][self._window[0]]
+        if np.shape(bmap)[-2] != lat.size:
+            sys.exit('Latitude mismatch')
+        return lat
+
+    def _get_longitude(self, var, bmap):
+        lon = self._grid()[1][self._window[1]]
+        if np.shape(bmap)[-1] != lon.size:
+            sys.exit('Longitude mismatch')
+        return lon
+
+    def _get_nodata(self, var, bmap):
+        return self._get_bad(bmap)
+
     def _get_variables(self):
-        data = OrderedDict()
+        bmap = readbmap(self.filename, shape=self._shape(),
+                        dtype=self._dtype())
+        if self.bbox is not None:
+            window = subset(bmap, *self._window)
+            # Do not keep the whole in-memory grid alive for a small window.
+            if isinstance(bmap, np.memmap):
+                bmap = window
+            else:
+                bmap = np.array(window)
+        return LazyVariables(self, bmap)
+
+    def _lookup(self, var):
+        """Return (_get_ function for var, True if it is a method)."""
         try:
-            stream = readgz(self.filename)
-        except:
-            return data
-        bmap = unpack(stream, shape=self._shape(), dtype=self._dtype())
-        for var in self._variables():
-            data[var] = self._get_avariable(var, bmap)
-        return data
+            return _get_(var, _from_=self.__class__), True
+        except _NoMethodFound:
+            pass
+        try:
+            return _get_(var, _from_=thismodule()), False
+        except _NoMethodFound:
+            pass
+        return Dataset._default_get, True
+
+    def _get_window(self):
+        if self.bbox is None:
+            return slice(None), slice(None)
+        return bbox2window(self.bbox, *self._grid())
+
+    def _grid(self):
+        """Return (latitude, longitude) of the grid cell centers."""
+        return latitude(), longitude()
+
+
+def isgzip(filename):
+    """Return True if filename starts with the gzip magic number."""
+    with open(filename, 'rb') as f:
+        magic = f.read(2)
+    return magic == b'\x1f\x8b'
+
+
+def readbin(filename, shape, dtype):
+    """
+    Return read-only memory map of an uncompressed bytemap.
+    Nothing is read until the data are accessed, so decoding one variable
+    (or one lat/lon window) only pages in the bytes it needs.
+    """
+    nbytes = reduce(mul, shape) * np.dtype(dtype).itemsize
+    size = os.path.getsize(filename)
+    if size < nbytes:
+        raise IOError('%s: expected %d bytes, found %d (truncated file?)' %
+                      (filename, nbytes, size))
+    if size > nbytes:
+        raise IOError('%s: expected %d bytes, found %d (not a bytemap of '
+                      'this dataset?)' % (filename, nbytes, size))
+    return np.memmap(filename, dtype=dtype, mode='r', shape=shape)
+
 
+def readbmap(filename, shape, dtype):
+    """Return bytemap of a gzip-compressed or uncompressed data file."""
+    if isgzip(filename):
+        return readgz(filename, shape=shape, dtype=dtype)
+    return readbin(filename, shape=shape, dtype=dtype)
 
-def readgz(filename):
+
+def readgz(filename, shape, dtype, chunksize=2**20):
+    """
+    Return bytemap decompressed from a gzip file.
+    The stream is inflated chunk by chunk straight into a preallocated
+    array, so neither the whole stream nor a second copy of it is kept.
+    The stream must have exactly the bytes of shape and dtype.
+    """
+    bmap = np.empty(reduce(mul, shape), dtype=dtype)
+    buf = memoryview(bmap).cast('B')
+    nbytes = len(buf)
+    nread = 0
     with gzip.open(filename, 'rb') as f:
-        stream = f.read()
-    return stream
+        try:
+            while nread < nbytes:
+                n = f.readinto(buf[nread:nread + chunksize])
+                if not n:
+                    break
+                nread += n
+            extra = f.read(1)
+        except EOFError:
+            # Cut mid-stream: the bytes of the last chunk are lost.
+            raise IOError('%s: expected %d bytes, the gzip stream ends '
+                          'early (truncated file?)' % (filename, nbytes))
+    if nread < nbytes:
+        raise IOError('%s: expected %d bytes, decompressed %d '
+                      '(truncated file?)' % (filename, nbytes, nread))
+    if extra:
+        raise IOError('%s: expected %d bytes, decompressed more (not a '
+                      'bytemap of this dataset?)' % (filename, nbytes))
+    return bmap.reshape(shape)
 
 
 def thismodule():
@@ -125,13 +259,67 @@ def thismodule():
 
 
 def unpack(stream, shape, dtype):
+    """Return read-only view of stream (no copy) with the given shape."""
     count = reduce(mul, shape)
-    return np.fromstring(stream, dtype=dtype, count=count).reshape(shape)
+    return np.frombuffer(stream, dtype=dtype, count=count).reshape(shape)
 
 
 """Library of Methods for _get_ Functions:"""
 
 
+def bbox2window(bbox, lat, lon):
+    """
+    Return (rows, cols) indices of the grid cells whose centers lie inside
+    bbox = (lon0, lon1, lat0, lat1).  Longitudes may wrap across 0, e.g.
+    (350, 10) or (-10, 10); cols are then ordered from lon0 eastward.
+    Contiguous indices are returned as slices so that indexing gives views.
+    """
+    lon0, lon1, lat0, lat1 = bbox
+    rows = np.flatnonzero((lat >= lat0) & (lat <= lat1))
+    if lon1 - lon0 >= 360:
+        cols = np.arange(lon.size)
+    else:
+        east = np.mod(lon - lon0, 360)
+        cols = np.flatnonzero(east <= np.mod(lon1 - lon0, 360))
+        cols = cols[np.argsort(east[cols], kind='stable')]
+    if not rows.size or not cols.size:
+        raise ValueError('No grid cells inside bbox %s' % (bbox,))
+    return asslice(rows), asslice(cols)
+
+
+def asslice(indx):
+    """Return indx as a slice if it is a contiguous increasing range."""
+    if np.all(np.diff(indx) == 1):
+        return slice(indx[0], indx[-1] + 1)
+    return indx
+
+
+def bytemap_table(varspec, missing, dtype=np.float64, maxvalid=250):
+    """
+    Return the 256-entry lookup table that decodes every byte code of a
+    variable described by varspec (see Bytemap), so that decoding a byte
+    plane is a single np.take.
+    """
+    codes = np.arange(256)
+    if 'flag' in varspec:
+        return np.isin(codes, varspec['flag'])
+    fill = np.nan if missing is None else missing
+    if 'table' in varspec:
+        values = varspec['table'](codes, fill)
+    else:
+        if 'bits' in varspec:
+            values = ibits(codes, *varspec['bits'])
+        else:
+            values = codes
+        values = (values * varspec.get('scale', 1.0) +
+                  varspec.get('offset', 0.0))
+    values = np.array(values, dtype=np.float64)
+    if varspec.get('mask', 'self') == 'self':
+        bad = codes > maxvalid
+        values[bad] = missing if missing else codes[bad]
+    return values.astype(dtype)
+
+
 def btest(ival, ipos):
     """Same usage as Fortran btest function."""
     return (ival & (1 << ipos)) != 0
@@ -141,9 +329,44 @@ def cosd(x):
     return np.cos(np.radians(x))
 
 
+def decode_uv(speed, direction, bad, missing, scale=(0.2, 1.5),
+              dtype=np.float64, out=None):
+    """
+    Decode wind speed and direction bytes into (u, v) components.
+    Speed, sin and cos are 256-entry lookup tables over the byte codes, so
+    no trigonometry is done on the grid.  Bad cells are set to missing, NaN
+    if missing is None.  out = optional preallocated (u, v) arrays.
+    """
+    fill = np.nan if missing is None else missing
+    codes = np.arange(256)
+    speeds = scale[0] * codes
+    tables = sind(scale[1] * codes), cosd(scale[1] * codes)
+    if out is None:
+        out = tuple(np.empty(np.shape(speed), dtype=dtype) for _ in tables)
+    for table, component in zip(tables, out):
+        np.take(speeds.astype(component.dtype), speed, out=component)
+        component *= table.astype(component.dtype).take(direction)
+        np.copyto(component, fill, where=bad)
+    return out
+
+
+def filedate(filename):
+    """
+    Return datetime.date parsed from an RSS file name, e.g.
+    qscat_20091031v4.gz (daily, 3-day, weekly) or qscat_200910v4.gz
+    (monthly, day is set to 1).
+    """
+    name = os.path.basename(filename)
+    match = re.search(r'_(\d{4})(\d{2})(\d{2})?v\d', name)
+    if not match:
+        raise ValueError('No date in file name %s' % filename)
+    year, month, day = match.groups()
+    return datetime.date(int(year), int(month), int(day or 1))
+
+
 def get_data(bmap, indx, dtype=np.float64):
     """Return numpy array of dytpe for the variable in bmap given by indx."""
-    return np.array(np.squeeze(bmap[..., indx, :, :]), dtype=dtype)
+    return np.array(bmap[..., indx, :, :], dtype=dtype)
 
 
 def get_uv(speed, direction):
@@ -156,6 +379,53 @@ def get_uv(speed, direction):
     return u, v
 
 
+@lru_cache(maxsize=None)
+def latitude(nlat=720, dlat=0.25, lat0=-89.875):
+    """Return latitudes of the grid cell centers (shared, read-only)."""
+    lat = dlat * np.arange(nlat) + lat0
+    lat.setflags(write=False)
+    return lat
+
+
+@lru_cache(maxsize=None)
+def longitude(nlon=1440, dlon=0.25, lon0=0.125):
+    """Return longitudes of the grid cell centers (shared, read-only)."""
+    lon = dlon * np.arange(nlon) + lon0
+    lon.setflags(write=False)
+    return lon
+
+
+def uv2spddir(u, v):
+    """
+    Given u (zonal) and v (meridional) components, return speed and
+    direction (degrees oceanographic, the wind is blowing to).
+    """
+    speed = np.hypot(u, v)
+    direction = np.mod(np.degrees(np.arctan2(u, v)), 360)
+    return speed, direction
+
+
+def vector_mean(u, v, axis=None, missing=-999.):
+    """
+    Average wind vectors in vector space and return (speed, direction) of
+    the mean vector.  Missing (and NaN) values of u or v are skipped;
+    cells without any valid vector are set to missing.
+    """
+    u = np.asarray(u, dtype=np.float64)
+    v = np.asarray(v, dtype=np.float64)
+    valid = np.isfinite(u) & np.isfinite(v)
+    if missing is not None:
+        valid &= (u != missing) & (v != missing)
+    count = valid.sum(axis=axis)
+    umean = np.where(valid, u, 0.).sum(axis=axis) / np.maximum(count, 1)
+    vmean = np.where(valid, v, 0.).sum(axis=axis) / np.maximum(count, 1)
+    speed, direction = uv2spddir(umean, vmean)
+    fill = np.nan if missing is None else missing
+    speed = np.where(count > 0, speed, fill)
+    direction = np.where(count > 0, direction, fill)
+    return speed, direction
+
+
 def ibits(ival, ipos, ilen):
     """Same usage as Fortran ibits function."""
     ones = ((1 << ilen)-1)
@@ -167,9 +437,33 @@ def is_bad(bmap, maxvalid=250):
     return bmap > maxvalid
 
 
+def radrain_table(codes, fill):
+    """
+    Return radiometer rain for rain byte codes:
+        bit 1 = collocated radiometer data present (else fill)
+        bits 2-7 = radiometer rain: 0 = no rain, 1 = adjacent rain (-1),
+                   n > 1 = 0.5*(n-1) km*mm/hr
+    (bit 0, the scatterometer rain flag, is the scatflag variable).
+    """
+    intrain = ibits(codes, ipos=2, ilen=6)
+    radrain = 0.5 * (intrain - 1.0)
+    radrain[intrain == 1] = -1.0
+    radrain[intrain == 0] = 0.0
+    radrain[~btest(codes, 1)] = fill
+    return radrain
+
+
 def sind(x):
     return np.sin(np.radians(x))
 
+
+def subset(bmap, rows, cols):
+    """Return the (rows, cols) window of bmap; a view if both are slices."""
+    bmap = bmap[..., rows, :]
+    if isinstance(cols, slice):
+        return bmap[..., cols]
+    return bmap.take(cols, axis=-1)
+
 where = np.where
 
 
@@ -189,28 +483,40 @@ def _get_(var, _from_):
     return getattr(_from_, '_get_%s' % var)
 
 
+_CLASSCACHE = {}
+
+
+def _classcache(cls):
+    """
+    Return the cache shared by all instances of a Dataset class:
+        attributes = dictionary of attributes for each variable
+        get = dictionary of (_get_ function, is method) for each variable
+    """
+    return _CLASSCACHE.setdefault(cls, dict(attributes={}, get={}))
+
+
 def _get_ice(var, bmap, indx=0, icevalue=252):
-    return get_data(bmap, indx, dtype=bmap.dtype) == icevalue
+    return bmap[..., indx, :, :] == icevalue
 
 
 def _get_land(var, bmap, indx=0, landvalue=255):
-    return get_data(bmap, indx, dtype=bmap.dtype) == landvalue
+    return bmap[..., indx, :, :] == landvalue
 
 
 def _get_latitude(var, bmap, nlat=720, dlat=0.25, lat0=-89.875):
     if np.shape(bmap)[-2] != nlat:
         sys.exit('Latitude mismatch')
-    return np.array([dlat*ilat + lat0 for ilat in range(nlat)])
+    return latitude(nlat, dlat, lat0)
 
 
 def _get_longitude(var, bmap, nlon=1440, dlon=0.25, lon0=0.125):
     if np.shape(bmap)[-1] != nlon:
         sys.exit('Longitude mismatch')
-    return np.array([dlon*ilon + lon0 for ilon in range(nlon)])
+    return longitude(nlon, dlon, lon0)
 
 
 def _get_nodata(var, bmap, indx=0):
-    return is_bad(get_data(bmap, indx, dtype=bmap.dtype))
+    return is_bad(bmap[..., indx, :, :])
 
 
 class Variable(np.ndarray):
@@ -218,12 +524,64 @@ class Variable(np.ndarray):
 
     def __new__(cls, var, data, dataset):
         obj = np.asarray(data).view(cls)
-        for attr in dataset._attributes():
-            get = _get_(attr, _from_=dataset)
-            setattr(obj, attr, get(var))
+        obj.__dict__.update(dataset._get_attributes(var))
         return obj
 
 
+class LazyVariables(Mapping):
+    """
+    Read-only mapping of variable name to Variable.
+
+    Nothing is decoded until a variable is accessed; the decoded Variable is
+    then cached.  drop(var) releases a cached Variable (or all of them) and
+    the next access decodes it again from the raw bytemap.
+    """
+
+    def __init__(self, dataset, bmap):
+        self._dataset = dataset
+        self._bmap = bmap
+        self._cache = {}
+
+    def __getitem__(self, var):
+        try:
+            return self._cache[var]
+        except KeyError:
+            pass
+        if var not in self._dataset._variables():
+            raise KeyError(var)
+        data = self._dataset._get_avariable(var, self._bmap)
+        self._cache[var] = data
+        return data
+
+    def __contains__(self, var):
+        # Mapping.__contains__ would decode var.
+        return var in self._dataset._variables()
+
+    def __iter__(self):
+        return iter(self._dataset._variables())
+
+    def __len__(self):
+        return len(self._dataset._variables())
+
+    def __repr__(self):
+        return '%s(%s)' % (self.__class__.__name__, list(self))
+
+    def drop(self, var=None):
+        """Release decoded var, or every decoded variable if var is None."""
+        if var is None:
+            self._cache.clear()
+        else:
+            self._cache.pop(var, None)
+
+    def cache(self, var, data):
+        """Cache data already decoded for var unless var is loaded."""
+        self._cache.setdefault(var, data)
+
+    def loaded(self):
+        """Return list of variables currently decoded."""
+        return [var for var in self if var in self._cache]
+
+
 OneOb = namedtuple('OneOb', 'lon lat asc val ndp')
 """
 OneOb corresponds to one observation from verify file with:
@@ -258,12 +616,320 @@ def zerobased(indx):
     return indx - 1
 
 
-class QuikScatDaily(Dataset):
+class Verify(object):
+    """Observations of an RSS verify file.
+    Public data:
+        filename = name of verify file
+        variables = list of verified variables
+        obs = dictionary of observations for each variable, a structured
+              array with the OneOb fields (0-based lon, lat and asc)
+
+    For each variable the verify file has a block of values starting at
+    startline[var] (1-based): one line per latitude index from ilat1 to
+    ilat2, each with one value per longitude index from ilon1 to ilon2.
+    All indices are 1-based, as in the verify file; iasc is the orbit
+    segment of daily files and None for time-averaged files.
+    """
+
+    def __init__(self, filename, startline, ilon1, ilon2, ilat1, ilat2,
+                 iasc=None):
+        self.filename = filename
+        self.variables = list(startline)
+        lines = readtext(filename)
+        asc = zerobased(iasc) if iasc else 0
+        self.obs = OrderedDict()
+        for var in self.variables:
+            obs = []
+            for iline, ilat in enumerate(range(ilat1, ilat2 + 1)):
+                tokens = tokenize(lines[zerobased(startline[var]) + iline])
+                for token, ilon in zip(tokens, range(ilon1, ilon2 + 1)):
+                    obs.append(OneOb(lon=zerobased(ilon), lat=zerobased(ilat),
+                                     asc=asc, val=float(token),
+                                     ndp=places(token)))
+            self.obs[var] = np.array(obs, dtype=self._obtype())
+        self._hasasc = iasc is not None
+
+    def _obtype(self):
+        return [('lon', np.int16), ('lat', np.int16), ('asc', np.int8),
+                ('val', np.float64), ('ndp', np.int8)]
+
+    def check(self, dataset):
+        """
+        Return dictionary with the number of observations of each variable
+        whose decoded value differs from the verify value at its number of
+        decimal places (0 means the variable is verified).
+        """
+        if dataset.bbox is not None:
+            raise ValueError('Verify needs the whole grid (bbox=None)')
+        failed = OrderedDict()
+        for var, obs in self.obs.items():
+            indx = (obs['lat'], obs['lon'])
+            if self._hasasc:
+                indx = (obs['asc'],) + indx
+            data = np.asarray(dataset.variables[var])[indx]
+            tolerance = 0.5 * 10.0 ** obs['ndp'] + 1e-9
+            failed[var] = int(np.sum(~(np.abs(data - obs['val']) <=
+                                       tolerance)))
+        return failed
+
+
+class Bytemap(Dataset):
+    """Read bytemaps described by a specification.
+    Public data:
+        filename = name of data file
+        spec = dictionary describing the bytemap (see below)
+        missing = fill value used for missing data;
+                  if None, then fill with byte codes (251-255)
+        bbox = (lon0, lon1, lat0, lat1) of the decoded region, or None
+        dtype = floating point type of the decoded variables
+        dimensions = dictionary of dimensions for each coordinate
+        variables = mapping of data for each variable
+
+    The spec replaces the "_get_" methods of hand-written Dataset classes:
+        shape = shape of raw data (tuple)
+        coordinates = coordinates (tuple), including 'variable'
+        latitude = keyword arguments of latitude()
+        longitude = keyword arguments of longitude()
+        variables = ordered dictionary with a dictionary for each variable:
+            long_name, units, valid_min, valid_max = attributes
+            and how to decode it, one of
+            coordinate = True for latitude and longitude
+            nodata = True for the (shared) mask of cells without data
+            uv = (speed, direction) variables; component = 0 (u) or 1 (v)
+            index = bmap index of the byte plane, plus either
+                flag = byte codes that are True (boolean variable), or
+                table = function(codes, fill) returning decoded values, or
+                bits = (ipos, ilen) bit field (default whole byte) and
+                scale, offset (default 1 and 0)
+                mask = 'self' (default) for codes 251-255 of this plane,
+                       'nodata' for cells without data in plane 0, or None
+                group = name shared by variables of the same plane that
+                        are decoded together (e.g. the rain flags)
+
+    Byte-plane variables are compiled into 256-entry lookup tables (see
+    bytemap_table), so decoding one is a single np.take over the plane.
+    Tables and attributes are built once per spec and shared by all files.
+    """
+
+    spec = None
+
+    def __init__(self, filename, spec=None, missing=-999., bbox=None,
+                 dtype=np.float64):
+        """
+        Required arguments:
+            filename = name of data file to be read (string), gzip or
+                       decompressed bytemap
+            spec = bytemap specification, e.g. QSCAT_AVERAGED for the
+                   3-day, weekly and monthly QuikScat products; not needed
+                   by classes that set spec
+
+        Optional arguments:
+            missing, bbox, dtype = see QuikScatDaily
+        """
+        if spec is not None:
+            self.spec = spec
+        if self.spec is None:
+            raise ValueError('No bytemap specification')
+        self.filename = filename
+        self.missing = missing
+        self.bbox = bbox
+        self.dtype = dtype
+        Dataset.__init__(self)
+
+    def _attributes(self):
+        return ['coordinates', 'long_name', 'units', 'valid_min', 'valid_max']
+
+    def _cache(self):
+        # One cache per spec object, which keeps it alive so that its id
+        # is not reused by another spec.
+        cache = _classcache((self.__class__, id(self.spec)))
+        cache.setdefault('spec', self.spec)
+        return cache
+
+    def _coordinates(self):
+        return self.spec['coordinates']
+
+    def _shape(self):
+        return self.spec['shape']
+
+    def _variables(self):
+        return list(self.spec['variables'])
+
+    def _get_attributes(self, var):
+        attributes = self._cache()['attributes']
+        try:
+            return attributes[var]
+        except KeyError:
+            pass
+        varspec = self.spec['variables'][var]
+        attrs = OrderedDict(coordinates=self._get_coordinates(var))
+        for attr in self._attributes()[1:]:
+            attrs[attr] = varspec[attr]
+        return attributes.setdefault(var, attrs)
+
+    def _lookup(self, var):
+        """Methods named _get_var in subclasses override the spec."""
+        func = getattr(self.__class__, '_get_' + var, None)
+        if func is not None and not hasattr(Dataset, '_get_' + var):
+            return func, True
+        varspec = self.spec['variables'][var]
+        if varspec.get('coordinate'):
+            return _get_(var, _from_=Dataset), True
+        if varspec.get('nodata'):
+            return Dataset._get_nodata, True
+        if 'uv' in varspec:
+            return Bytemap._decode_uv, True
+        if 'group' in varspec:
+            return Bytemap._decode_group, True
+        return Bytemap._decode_table, True
+
+    def _decode_table(self, var, bmap, plane=None, out=None):
+        """Decode var from its byte plane (read from bmap unless given)
+        into out, preallocated, if given."""
+        varspec = self.spec['variables'][var]
+        if plane is None:
+            plane = bmap[..., varspec['index'], :, :]
+        data = np.take(self._table(var), plane, out=out)
+        if varspec.get('mask') == 'nodata':
+            fill = np.nan if self.missing is None else self.missing
+            np.copyto(data, fill, where=self._get_bad(bmap))
+        return data
+
+    def _decode_group(self, var, bmap):
+        """Decode var and the other variables of its group in one pass over
+        their byte plane, into preallocated arrays; the others are cached
+        too."""
+        varspec = self.spec['variables'][var]
+        plane = np.asarray(bmap[..., varspec['index'], :, :])
+        loaded = self.variables.loaded()
+        for other, spec in self.spec['variables'].items():
+            if spec.get('group') != varspec['group'] or other in loaded:
+                continue
+            out = np.empty(plane.shape, dtype=self._table(other).dtype)
+            data = self._decode_table(other, bmap, plane=plane, out=out)
+            if other == var:
+                result = data
+            else:
+                self.variables.cache(other, Variable(other, data, self))
+        return result
+
+    def _decode_uv(self, var, bmap):
+        """Decode both wind components; the other one is cached too."""
+        varspec = self.spec['variables'][var]
+        speed, direction = [self.spec['variables'][v]
+                            for v in varspec['uv']]
+        wind = decode_uv(bmap[..., speed['index'], :, :],
+                         bmap[..., direction['index'], :, :],
+                         self._get_bad(bmap), self.missing,
+                         scale=(speed['scale'], direction['scale']),
+                         dtype=self.dtype)
+        for other, spec in self.spec['variables'].items():
+            if spec.get('uv') == varspec['uv'] and other != var:
+                data = wind[spec['component']]
+                self.variables.cache(other, Variable(other, data, self))
+        return wind[varspec['component']]
+
+    def _grid(self):
+        return (latitude(**self.spec['latitude']),
+                longitude(**self.spec['longitude']))
+
+    def _table(self, var):
+        tables = self._cache().setdefault('tables', {})
+        key = (var, str(self.missing), np.dtype(self.dtype).str)
+        try:
+            return tables[key]
+        except KeyError:
+            pass
+        table = bytemap_table(self.spec['variables'][var], self.missing,
+                              dtype=self.dtype)
+        return tables.setdefault(key, table)
+
+
+"""Library of Bytemap Specifications:"""
+
+
+def _qscat_variables(index):
+    """Return variables of QuikScat bytemaps with the given plane indices."""
+    variables = OrderedDict()
+    if 'mingmt' in index:
+        variables['mingmt'] = dict(
+            index=index['mingmt'], scale=6.0, mask=None,
+            long_name='Minute of Day UTC', units='minute of day',
+            valid_min=0.0, valid_max=1440.0)
+    variables['windspd'] = dict(
+        index=index['windspd'], scale=0.2,
+        long_name='10-m Surface Wind Speed', units='m/s',
+        valid_min=0.0, valid_max=50.0)
+    variables['winddir'] = dict(
+        index=index['winddir'], scale=1.5,
+        long_name='10-m Surface Wind Direction', units='deg oceanographic',
+        valid_min=0.0, valid_max=360.0)
+    variables['scatflag'] = dict(
+        index=index['rain'], bits=(0, 1), mask='nodata', group='rain',
+        long_name='Scatterometer Rain Flag', units='0=no-rain, 1=rain',
+        valid_min=0, valid_max=1)
+    variables['radrain'] = dict(
+        index=index['rain'], table=radrain_table, mask='nodata',
+        group='rain',
+        long_name='Radiometer Rain Flag',
+        units='0=no-rain, -1=adjacent rain, >0=rain(km*mm/hr)',
+        valid_min=-1, valid_max=31)
+    variables['longitude'] = dict(
+        coordinate=True,
+        long_name='Grid Cell Center Longitude', units='degrees east',
+        valid_min=0.0, valid_max=360.0)
+    variables['latitude'] = dict(
+        coordinate=True,
+        long_name='Grid Cell Center Latitude', units='degrees north',
+        valid_min=-90.0, valid_max=90.0)
+    variables['land'] = dict(
+        index=0, flag=(255,),
+        long_name='Is this land?', units='True or False',
+        valid_min=False, valid_max=True)
+    variables['ice'] = dict(
+        index=0, flag=(252,),
+        long_name='Is this ice?', units='True or False',
+        valid_min=False, valid_max=True)
+    variables['nodata'] = dict(
+        nodata=True,
+        long_name='Is there no data?', units='True or False',
+        valid_min=False, valid_max=True)
+    variables['u'] = dict(
+        uv=('windspd', 'winddir'), component=0,
+        long_name='10-m Surface Zonal Wind', units='m/s',
+        valid_min=-50.0, valid_max=50.0)
+    variables['v'] = dict(
+        uv=('windspd', 'winddir'), component=1,
+        long_name='10-m Surface Meridional Wind', units='m/s',
+        valid_min=-50.0, valid_max=50.0)
+    return variables
+
+
+QSCAT_DAILY = dict(
+    shape=(2, 4, 720, 1440),
+    coordinates=('orbit_segment', 'variable', 'latitude', 'longitude'),
+    latitude=dict(nlat=720, dlat=0.25, lat0=-89.875),
+    longitude=dict(nlon=1440, dlon=0.25, lon0=0.125),
+    variables=_qscat_variables(dict(mingmt=0, windspd=1, winddir=2, rain=3)))
+"""Daily QuikScat bytemaps (version 4)."""
+
+QSCAT_AVERAGED = dict(
+    shape=(3, 720, 1440),
+    coordinates=('variable', 'latitude', 'longitude'),
+    latitude=dict(nlat=720, dlat=0.25, lat0=-89.875),
+    longitude=dict(nlon=1440, dlon=0.25, lon0=0.125),
+    variables=_qscat_variables(dict(windspd=0, winddir=1, rain=2)))
+"""3-day, weekly and monthly QuikScat bytemaps (version 4)."""
+
+
+class QuikScatDaily(Bytemap):
     """Read daily QSCAT bytemaps.
     Public data:
         filename = name of data file
         missing = fill value used for missing data;
                   if None, then fill with byte codes (251-255)
+        bbox = (lon0, lon1, lat0, lat1) of the decoded region, or None
+        dtype = floating point type of the decoded variables
         dimensions = dictionary of dimensions for each coordinate
         variables = dictionary of data for each variable
 
@@ -293,6 +959,8 @@ class QuikScatDaily(Dataset):
     'land' : 'Is this land?',
     'ice' : 'Is this ice?',
     'nodata' : 'Is there no data?'
+    'u' : '10-m Surface Zonal Wind', derived from windspd and winddir
+    'v' : '10-m Surface Meridional Wind', derived from windspd and winddir
 
     The center of the first cell of the 1440 column and 720 row map is at
     0.125 E longitude and -89.875 latitude.
@@ -306,132 +974,39 @@ class QuikScatDaily(Dataset):
     program created for quikscat  Aug 2013
     """
 
-    def __init__(self, filename, missing=-999.):
+    spec = QSCAT_DAILY
+
+    def __init__(self, filename, missing=-999., bbox=None,
+                 dtype=np.float64):
         """
         Required arguments:
-            filename = name of data file to be read (string)
+            filename = name of data file to be read (string);
+                       either the gzip-compressed file as distributed by
+                       RSS or the decompressed bytemap, which is
+                       memory-mapped instead of read into memory
 
         Optional arguments:
             missing = fill value for missing data,
                       default is the value used in verify file
+            bbox = (lon0, lon1, lat0, lat1) in degrees; only grid cells
+                   inside the box are decoded, default is the whole grid.
+                   Use lon0 > lon1 (or a negative lon0) to cross 0 E.
+            dtype = floating point type of the decoded variables, default
+                    is np.float64; np.float32 halves memory and is exact
+                    enough for the 8-bit data
         """
-        self.filename = filename
-        self.missing = missing
-        Dataset.__init__(self)
-
-    def _attributes(self):
-        return ['coordinates', 'long_name', 'units', 'valid_min', 'valid_max']
+        Bytemap.__init__(self, filename, missing=missing, bbox=bbox,
+                         dtype=dtype)
 
-    def _coordinates(self):
-        return ('orbit_segment', 'variable', 'latitude', 'longitude')
-
-    def _shape(self):
-        return (2, 4, 720, 1440)
 
-    def _variables(self):
-        return ['mingmt', 'windspd', 'winddir', 'scatflag', 'radrain',
-                'longitude', 'latitude', 'land', 'ice', 'nodata']
-
-    def _get_index(self, var):
-        return {'windspd': 1,
-                'winddir': 2,
-                'rain': 3,
-                }[var]
-
-    def _get_scale(self, var):
-        return {'mingmt': 6.0,
-                'windspd': 0.2,
-                'winddir': 1.5,
-                }[var]
-
-    def _get_long_name(self, var):
-        return {'mingmt': 'Minute of Day UTC',
-                'windspd': '10-m Surface Wind Speed',
-                'winddir': '10-m Surface Wind Direction',
-                'scatflag': 'Scatterometer Rain Flag',
-                'radrain': 'Radiometer Rain Flag',
-                'longitude': 'Grid Cell Center Longitude',
-                'latitude': 'Grid Cell Center Latitude',
-                'land': 'Is this land?',
-                'ice': 'Is this ice?',
-                'nodata': 'Is there no data?',
-                }[var]
-
-    def _get_units(self, var):
-        return {'mingmt': 'minute of day',
-                'windspd': 'm/s',
-                'winddir': 'deg oceanographic',
-                'scatflag': '0=no-rain, 1=rain',
-                'radrain': '0=no-rain, -1=adjacent rain, >0=rain(km*mm/hr)',
-                'longitude': 'degrees east',
-                'latitude': 'degrees north',
-                'land': 'True or False',
-                'ice': 'True or False',
-                'nodata': 'True or False',
-                }[var]
-
-    def _get_valid_min(self, var):
-        return {'mingmt': 0.0,
-                'windspd': 0.0,
-                'winddir': 0.0,
-                'scatflag': 0,
-                'radrain': -1,
-                'longitude': 0.0,
-                'latitude': -90.0,
-                'land': False,
-                'ice': False,
-                'nodata': False,
-                }[var]
-
-    def _get_valid_max(self, var):
-        return {'mingmt': 1440.0,
-                'windspd': 50.0,
-                'winddir': 360.0,
-                'scatflag': 1,
-                'radrain': 31,
-                'longitude': 360.0,
-                'latitude': 90.0,
-                'land': True,
-                'ice': True,
-                'nodata': True,
-                }[var]
-
-    def _get_mingmt(self, var, bmap):
-        mingmt = get_data(bmap, indx=0)
-        mingmt *= self._get_scale(var)
-        return mingmt
-
-    def _get_scatflag(self, var, bmap):
-        indx = self._get_index('rain')
-        scatflag = get_data(ibits(bmap, ipos=0, ilen=1), indx=indx)
-        bad = is_bad(get_data(bmap, indx=0))
-        scatflag[bad] = self.missing
-        return scatflag
-
-    def _get_radrain(self, var, bmap):
-        indx = self._get_index('rain')
-        radrain = get_data(ibits(bmap, ipos=1, ilen=1), indx=indx)
-        good = (radrain == 1)
-        radrain[~good] = self.missing
-        intrain = get_data(ibits(bmap, ipos=2, ilen=6), indx=indx)
-        nonrain = where(intrain == 0)
-        adjrain = where(intrain == 1)
-        hasrain = where(intrain > 1)
-        intrain[nonrain] = 0.0
-        intrain[adjrain] = -1.0
-        intrain[hasrain] = 0.5 * (intrain[hasrain]-1)
-        radrain[good] = intrain[good]
-        bad = is_bad(get_data(bmap, indx=0))
-        radrain[bad] = self.missing
-        return radrain
-
-
-class QuikScatAveraged(Dataset):
+class QuikScatAveraged(Bytemap):
     """ Read averaged QSCAT bytemaps.
     Public data:
         filename = name of data file
         missing = fill value used for missing data;
                   if None, then fill with byte codes (251-255)
+        bbox = (lon0, lon1, lat0, lat1) of the decoded region, or None
+        dtype = floating point type of the decoded variables
         dimensions = dictionary of dimensions for each coordinate
         variables = dictionary of data for each variable
 
@@ -459,6 +1034,8 @@ class QuikScatAveraged(Dataset):
     'land' : 'Is this land?',
     'ice' : 'Is this ice?',
     'nodata' : 'Is there no data?'
+    'u' : '10-m Surface Zonal Wind', derived from windspd and winddir
+    'v' : '10-m Surface Meridional Wind', derived from windspd and winddir
 
     The center of the first cell of the 1440 column and 720 row map is at
     0.125 E longitude and -89.875 latitude.  The center of the second cell is
@@ -472,110 +1049,492 @@ class QuikScatAveraged(Dataset):
     program created for quikscat  Aug 2013
     """
 
-    def __init__(self, filename, missing=-999.):
+    spec = QSCAT_AVERAGED
+
+    def __init__(self, filename, missing=-999., bbox=None,
+                 dtype=np.float64):
         """
         Required arguments:
-            filename = name of data file to be read (string)
+            filename = name of data file to be read (string);
+                       either the gzip-compressed file as distributed by
+                       RSS or the decompressed bytemap, which is
+                       memory-mapped instead of read into memory
 
         Optional arguments:
             missing = fill value for missing data,
                       default is the value used in verify file
+            bbox = (lon0, lon1, lat0, lat1) in degrees; only grid cells
+                   inside the box are decoded, default is the whole grid.
+                   Use lon0 > lon1 (or a negative lon0) to cross 0 E.
+            dtype = floating point type of the decoded variables, default
+                    is np.float64; np.float32 halves memory and is exact
+                    enough for the 8-bit data
         """
-        self.filename = filename
+        Bytemap.__init__(self, filename, missing=missing, bbox=bbox,
+                         dtype=dtype)
+
+
+def _decode(args):
+    """Return the requested variables of one file (process pool worker)."""
+    cls, filename, variables, kw = args
+    dataset = cls(filename, **kw)
+    return [np.asarray(dataset.variables[var]) for var in variables]
+
+
+class QuikScatCollection(object):
+    """Read a time series of QSCAT bytemaps.
+    Public data:
+        filenames = data files, sorted by date
+        times = datetime.date of each file, parsed from the RSS file name
+        dimensions = dictionary of dimensions for each coordinate
+        variables = dictionary of data for each variable; gridded variables
+                    are stacked along a leading time axis, e.g.
+                    (time, orbit_segment, latitude, longitude) for daily
+                    files, latitude and longitude are not
+
+    Files are decoded in parallel by a process pool straight into
+    preallocated arrays; every file is opened with the same missing, bbox
+    and dtype options as the single-file readers.
+    """
+
+    def __init__(self, filenames, variables=('windspd', 'winddir'),
+                 bbox=None, missing=-999., dtype=np.float64,
+                 dataset=QuikScatDaily, processes=None):
+        """
+        Required arguments:
+            filenames = glob pattern (string) or list of data files
+
+        Optional arguments:
+            variables = variables to read, default is windspd and winddir
+            bbox, missing, dtype = see QuikScatDaily
+            dataset = reader class of the files, default is QuikScatDaily
+            processes = number of worker processes, default is the number
+                        of CPUs; 1 decodes serially in this process
+        """
+        if isinstance(filenames, str):
+            filenames = glob.glob(filenames)
+        if not filenames:
+            raise ValueError('No data files to read')
+        self.filenames = sorted(filenames, key=filedate)
+        self.times = [filedate(filename) for filename in self.filenames]
+        self.bbox = bbox
         self.missing = missing
-        Dataset.__init__(self)
+        self.dtype = dtype
+        kw = dict(missing=missing, bbox=bbox, dtype=dtype)
+        first = dataset(self.filenames[0], **kw)
+        self.dimensions = OrderedDict(time=len(self.filenames))
+        self.dimensions.update(first.dimensions)
+
+        gridded = [var for var in variables
+                   if var not in first._coordinates()]
+        self.variables = OrderedDict()
+        for var in variables:
+            if var not in gridded:
+                self.variables[var] = first.variables[var]
+        out = [np.empty((len(self.filenames),) + first.variables[var].shape,
+                        dtype=first.variables[var].dtype) for var in gridded]
+        self._fill(out, [[first.variables[var] for var in gridded]])
+        first.variables.drop()
+
+        tasks = [(dataset, filename, gridded, kw)
+                 for filename in self.filenames[1:]]
+        if processes == 1:
+            self._fill(out, map(_decode, tasks), start=1)
+        else:
+            with Pool(processes) as pool:
+                self._fill(out, pool.imap(_decode, tasks), start=1)
+        for var, data in zip(gridded, out):
+            self.variables[var] = Variable(var, data, first)
+            coordinates = self.variables[var].coordinates
+            self.variables[var].coordinates = ('time',) + coordinates
 
-    def _attributes(self):
-        return ['coordinates', 'long_name', 'units', 'valid_min', 'valid_max']
+    def _fill(self, out, results, start=0):
+        for itime, result in enumerate(results, start):
+            for data, decoded in zip(out, result):
+                data[itime] = decoded
 
-    def _coordinates(self):
-        return ('variable', 'latitude', 'longitude')
 
-    def _shape(self):
-        return (3, 720, 1440)
+class QuikScatAggregator(object):
+    """Accumulate QSCAT bytemaps into time-averaged fields.
+    Public data:
+        variables = names of the variables being averaged
+        bbox = (lon0, lon1, lat0, lat1) of the decoded region, or None
+        missing = fill value used for cells without valid data
+        nfiles = number of files added so far
+        latitude, longitude = coordinates of the averaged fields
+
+    Files are added one at a time and only a running sum, sum of squares
+    and valid count per cell are kept, so memory does not grow with the
+    number of days.  Cells flagged as nodata, land or ice (and radrain
+    without radiometer data) are missing; both orbit segments of daily
+    files go into the same average, as in the QuikScatAveraged products.
+
+    Note that winddir must not be averaged directly; average u and v and
+    get the mean speed and direction with uv2spddir.
+    """
 
-    def _variables(self):
-        return ['windspd', 'winddir', 'scatflag', 'radrain',
-                'longitude', 'latitude', 'land', 'ice', 'nodata']
-
-    # _default_get():
-    def _get_index(self, var):
-        return {'windspd': 0,
-                'winddir': 1,
-                'rain': 2}[var]
-
-    def _get_scale(self, var):
-        return {'windspd': 0.2,
-                'winddir': 1.5}[var]
-
-    def _get_long_name(self, var):
-        return {'windspd': '10-m Surface Wind Speed',
-                'winddir': '10-m Surface Wind Direction',
-                'scatflag': 'Scatterometer Rain Flag',
-                'radrain': 'Radiometer Rain Flag',
-                'longitude': 'Grid Cell Center Longitude',
-                'latitude': 'Grid Cell Center Latitude',
-                'land': 'Is this land?',
-                'ice': 'Is this ice?',
-                'nodata': 'Is there no data?',
-                }[var]
-
-    def _get_units(self, var):
-        return {'windspd': 'm/s',
-                'winddir': 'deg oceanographic',
-                'scatflag': '0=no-rain, 1=rain',
-                'radrain': '0=no-rain, -1=adjacent rain, >0=rain(km*mm/hr)',
-                'longitude': 'degrees east',
-                'latitude': 'degrees north',
-                'land': 'True or False',
-                'ice': 'True or False',
-                'nodata': 'True or False',
-                }[var]
-
-    def _get_valid_min(self, var):
-        return {'windspd': 0.0,
-                'winddir': 0.0,
-                'scatflag': 0,
-                'radrain': -1,
-                'longitude': 0.0,
-                'latitude': -90.0,
-                'land': False,
-                'ice': False,
-                'nodata': False,
-                }[var]
-
-    def _get_valid_max(self, var):
-        return {'windspd': 50.0,
-                'winddir': 360.0,
-                'scatflag': 1,
-                'radrain': 31,
-                'longitude': 360.0,
-                'latitude': 90.0,
-                'land': True,
-                'ice': True,
-                'nodata': True,
-                }[var]
-
-    def _get_scatflag(self, var, bmap):
-        indx = self._get_index('rain')
-        scatflag = get_data(ibits(bmap, ipos=0, ilen=1), indx=indx)
-        bad = is_bad(get_data(bmap, indx=0))
-        scatflag[bad] = self.missing
-        return scatflag
-
-    def _get_radrain(self, var, bmap):
-        indx = self._get_index('rain')
-        radrain = get_data(ibits(bmap, ipos=1, ilen=1), indx=indx)
-        good = (radrain == 1)
-        radrain[~good] = self.missing
-        intrain = get_data(ibits(bmap, ipos=2, ilen=6), indx=indx)
-        nonrain = where(intrain == 0)
-        adjrain = where(intrain == 1)
-        hasrain = where(intrain > 1)
-        intrain[nonrain] = 0.0
-        intrain[adjrain] = -1.0
-        intrain[hasrain] = 0.5*(intrain[hasrain]-1)
-        radrain[good] = intrain[good]
-        bad = is_bad(get_data(bmap, indx=0))
-        radrain[bad] = self.missing
-        return radrain
+    def __init__(self, variables=('windspd',), bbox=None, missing=-999.,
+                 dataset=QuikScatDaily):
+        """
+        Optional arguments:
+            variables = variables to average, default is windspd
+            bbox = (lon0, lon1, lat0, lat1), see QuikScatDaily
+            missing = fill value of cells without any valid data
+            dataset = reader class of the files, default is QuikScatDaily
+        """
+        self.variables = list(variables)
+        self.bbox = bbox
+        self.missing = missing
+        self.nfiles = 0
+        self.latitude = None
+        self.longitude = None
+        self._dataset = dataset
+        self._attrs = {}
+        self._sum = {}
+        self._sumsq = {}
+        self._count = {}
+
+    def add(self, filename):
+        """Add one data file to the running statistics."""
+        dataset = self._dataset(filename, missing=np.nan, bbox=self.bbox)
+        if not self.nfiles:
+            self._start(dataset)
+        # Byte codes 251-255 (no data, land, ice) are missing whatever the
+        # mask of each variable (e.g. none for mingmt).
+        nodata = dataset.variables['nodata']
+        for var in self.variables:
+            data = np.asarray(dataset.variables[var])
+            dataset.variables.drop(var)
+            axis = tuple(range(data.ndim - 2))
+            valid = ~(np.isnan(data) | nodata)
+            data[~valid] = 0.
+            self._sum[var] += data.sum(axis=axis)
+            data *= data
+            self._sumsq[var] += data.sum(axis=axis)
+            self._count[var] += valid.sum(axis=axis)
+        self.nfiles += 1
+
+    def addfiles(self, filenames):
+        """Add every file of a glob pattern (string) or list of files."""
+        if isinstance(filenames, str):
+            filenames = sorted(glob.glob(filenames))
+        for filename in filenames:
+            self.add(filename)
+
+    def count(self):
+        """Return dictionary of number of valid values in each cell."""
+        return OrderedDict((var, self._variable(var, self._count[var]))
+                           for var in self.variables)
+
+    def mean(self):
+        """Return dictionary of the mean of each variable."""
+        means = OrderedDict()
+        for var in self.variables:
+            mean = self._divide(self._sum[var], self._count[var])
+            means[var] = self._variable(var, self._fill(mean, var))
+        return means
+
+    def std(self):
+        """Return dictionary of the (population) standard deviation."""
+        stds = OrderedDict()
+        for var in self.variables:
+            count = self._count[var]
+            mean = self._divide(self._sum[var], count)
+            var2 = self._divide(self._sumsq[var], count) - mean * mean
+            std = np.sqrt(np.maximum(var2, 0.))
+            stds[var] = self._variable(var, self._fill(std, var))
+        return stds
+
+    def _divide(self, total, count):
+        return total / np.maximum(count, 1)
+
+    def _fill(self, data, var):
+        data[self._count[var] == 0] = self.missing
+        return data
+
+    def _start(self, dataset):
+        self.latitude = dataset.variables['latitude']
+        self.longitude = dataset.variables['longitude']
+        shape = (self.latitude.size, self.longitude.size)
+        for var in self.variables:
+            variable = dataset.variables[var]
+            self._attrs[var] = dict((attr, getattr(variable, attr))
+                                    for attr in dataset._attributes())
+            self._attrs[var]['coordinates'] = ('latitude', 'longitude')
+            self._sum[var] = np.zeros(shape)
+            self._sumsq[var] = np.zeros(shape)
+            self._count[var] = np.zeros(shape, dtype=np.int64)
+
+    def _variable(self, var, data):
+        variable = np.asarray(data).view(Variable)
+        for attr, value in self._attrs[var].items():
+            setattr(variable, attr, value)
+        return variable
+
+
+def tonetcdf(filenames, ncfile, variables=('windspd', 'winddir'),
+             bbox=None, dataset=QuikScatDaily, complevel=4, chunksizes=None,
+             processes=None):
+    """
+    Convert bytemap files into a chunked, compressed netCDF4 file.
+
+    The decoded variables are appended along an unlimited time dimension,
+    with long_name, units, valid_min and valid_max from the reader, so the
+    gzip bytemaps are decoded once and later jobs read only the chunks they
+    need.  Only the first of several files with the same date is used,
+    and files whose date is already in an existing ncfile are skipped;
+    the other files must be dated after the last time of ncfile, so that
+    the time axis stays in order, and their dimensions, coordinates and
+    variables must match those of ncfile (ValueError otherwise, before
+    anything is written).  Files are decoded in a process pool and
+    written in date order.
+
+    Required arguments:
+        filenames = glob pattern (string) or list of data files
+        ncfile = name of netCDF file to create or append to
+
+    Optional arguments:
+        variables = variables to store, default is windspd and winddir
+        bbox = (lon0, lon1, lat0, lat1), see QuikScatDaily
+        dataset = reader class of the files, default is QuikScatDaily
+        complevel = zlib compression level
+        chunksizes = (latitude, longitude) chunk size, default is
+                     (180, 360) cells (one time step and orbit segment)
+        processes = number of worker processes, default is the number of
+                    CPUs; 1 decodes serially in this process
+
+    Requires netCDF4.
+    """
+    import netCDF4
+
+    if isinstance(filenames, str):
+        filenames = glob.glob(filenames)
+    # One file per date, in date order.
+    bydate = OrderedDict()
+    for filename in sorted(filenames, key=filedate):
+        bydate.setdefault(_days(filedate(filename)), filename)
+    filenames = list(bydate.values())
+    if not filenames:
+        raise ValueError('No data files to convert')
+    kw = dict(missing=-999., bbox=bbox, dtype=np.float32)
+
+    if os.path.exists(ncfile):
+        nc = netCDF4.Dataset(ncfile, 'a')
+        try:
+            _check_netcdf(nc, dataset(filenames[0], **kw), variables)
+        except ValueError:
+            nc.close()
+            raise
+        times = nc.variables['time'][:].tolist()
+        done = set(times)
+        filenames = [filename for filename in filenames
+                     if _days(filedate(filename)) not in done]
+        early = [filename for filename in filenames
+                 if times and _days(filedate(filename)) < times[-1]]
+        if early:
+            nc.close()
+            raise ValueError('%s: %s dated before its last time step' %
+                             (ncfile, ', '.join(early)))
+    else:
+        nc = netCDF4.Dataset(ncfile, 'w', format='NETCDF4')
+        first = dataset(filenames[0], **kw)
+        _create_netcdf(nc, first, variables, complevel, chunksizes)
+
+    tasks = [(dataset, filename, list(variables), kw)
+             for filename in filenames]
+    try:
+        if processes == 1:
+            _write_netcdf(nc, filenames, variables, map(_decode, tasks))
+        else:
+            with Pool(processes) as pool:
+                _write_netcdf(nc, filenames, variables,
+                              pool.imap(_decode, tasks))
+    finally:
+        nc.close()
+    return len(filenames)
+
+
+def _attribute(value):
+    """Return attribute value netCDF can store (no booleans)."""
+    if isinstance(value, (bool, np.bool_)):
+        return int(value)
+    return value
+
+
+def _check_netcdf(nc, dataset, variables):
+    """Raise ValueError if dataset and variables do not match nc."""
+    ncfile = nc.filepath()
+    for dim, size in dataset.dimensions.items():
+        if dim not in nc.dimensions or len(nc.dimensions[dim]) != size:
+            raise ValueError('%s: dimension %s does not match the data '
+                             '(other bbox or dataset?)' % (ncfile, dim))
+    for coord in ('latitude', 'longitude'):
+        if not np.allclose(nc.variables[coord][:],
+                           dataset.variables[coord]):
+            raise ValueError('%s: %s does not match the data (other bbox?)'
+                             % (ncfile, coord))
+    stored = set(nc.variables) - set(['time', 'latitude', 'longitude'])
+    if stored != set(variables):
+        raise ValueError('%s: has variables %s, not %s' %
+                         (ncfile, sorted(stored), sorted(variables)))
+    for var in variables:
+        dims = ('time',) + dataset._get_coordinates(var)
+        if nc.variables[var].dimensions != dims:
+            raise ValueError('%s: %s has dimensions %s, not %s (other '
+                             'dataset?)' % (ncfile, var,
+                                            nc.variables[var].dimensions,
+                                            dims))
+
+
+def _create_netcdf(nc, dataset, variables, complevel, chunksizes):
+    nc.createDimension('time', None)
+    for dim, size in dataset.dimensions.items():
+        nc.createDimension(dim, size)
+    time = nc.createVariable('time', 'i4', ('time',))
+    time.units = 'days since %s 00:00:00' % _EPOCH
+    time.calendar = 'standard'
+    for coord in ('latitude', 'longitude'):
+        data = dataset.variables[coord]
+        ncvar = nc.createVariable(coord, 'f8', (coord,))
+        ncvar[:] = data
+        for attr in ('long_name', 'units', 'valid_min', 'valid_max'):
+            setattr(ncvar, attr, _attribute(getattr(data, attr)))
+
+    nlat = dataset.dimensions['latitude']
+    nlon = dataset.dimensions['longitude']
+    chunklat, chunklon = chunksizes or (180, 360)
+    for var in variables:
+        data = dataset.variables[var]
+        dims = ('time',) + tuple(data.coordinates)
+        chunks = (1,) * (len(dims) - 2) + (min(chunklat, nlat),
+                                           min(chunklon, nlon))
+        if data.dtype == np.bool_:
+            ncvar = nc.createVariable(var, 'u1', dims, zlib=True,
+                                      complevel=complevel, chunksizes=chunks)
+        else:
+            ncvar = nc.createVariable(var, 'f4', dims, zlib=True,
+                                      complevel=complevel, chunksizes=chunks,
+                                      fill_value=dataset.missing)
+        for attr in ('long_name', 'units', 'valid_min', 'valid_max'):
+            setattr(ncvar, attr, _attribute(getattr(data, attr)))
+    dataset.variables.drop()
+
+
+def benchmark(filenames, dataset=QuikScatDaily, variables=None,
+              verify=None, **kw):
+    """
+    Time opening and decoding bytemap files with a reader class.
+
+    Every file is opened with dataset(filename, **kw) and the given
+    variables (default all) are decoded.  If verify (a Verify instance) is
+    given, the first file is checked against it, outside the timing.
+
+    Returns dictionary with:
+        files = number of files decoded
+        seconds = total wall time of opening and decoding
+        files_per_second = files decoded per second
+        mb_per_second = MB of byte codes decoded per second: one byte per
+                        cell (inside bbox) of each decoded variable, the
+                        coordinates excluded
+        failed = Verify.check result for the first file (None without
+                 verify)
+    """
+    if isinstance(filenames, str):
+        filenames = sorted(glob.glob(filenames))
+    if not filenames:
+        raise ValueError('No data files to benchmark')
+    failed = None
+    nbytes = 0
+    seconds = 0.
+    for filename in filenames:
+        start = time.perf_counter()
+        data = dataset(filename, **kw)
+        itemsize = np.dtype(data._dtype()).itemsize
+        for var in variables or data.variables:
+            decoded = data.variables[var]
+            if var not in data._coordinates():
+                nbytes += np.size(decoded) * itemsize
+        seconds += time.perf_counter() - start
+        if verify is not None and failed is None:
+            failed = verify.check(data)
+    return dict(files=len(filenames),
+                seconds=seconds,
+                files_per_second=len(filenames) / seconds,
+                mb_per_second=nbytes / 2.**20 / seconds,
+                failed=failed)
+
+
+_EPOCH = datetime.date(1970, 1, 1)
+
+
+def _days(date):
+    """Return date as days since _EPOCH (netCDF time value)."""
+    return (date - _EPOCH).days
+
+
+def _write_netcdf(nc, filenames, variables, results):
+    time = nc.variables['time']
+    for filename, result in zip(filenames, results):
+        itime = len(time)
+        time[itime] = _days(filedate(filename))
+        for var, data in zip(variables, result):
+            nc.variables[var][itime, ...] = data
+        nc.sync()
+
+
+def parse_args(arglist):
+    """Parse options with argparse."""
+    usage = """\nUsage: %(prog)s [options] ncfile file [file ...]\n
+    e.g.: %(prog)s -v windspd winddir qscat_2009.nc qscat_2009*v4.gz"""
+
+    description = "Convert RSS QuikScat bytemaps into a netCDF4 file"
+
+    parser = argparse.ArgumentParser(usage=usage,
+                                     description=description)
+    parser.add_argument('ncfile',
+                        help='netCDF file to create or append to')
+    parser.add_argument('filenames',
+                        metavar='file',
+                        nargs='+',
+                        help='RSS bytemap files (gzip or decompressed)')
+    parser.add_argument('-v', '--variables',
+                        nargs='+',
+                        default=['windspd', 'winddir'],
+                        help="variables to store, default=windspd winddir")
+    parser.add_argument('-b', '--bbox',
+                        nargs=4,
+                        type=float,
+                        metavar=('LON0', 'LON1', 'LAT0', 'LAT1'),
+                        help="only store the cells inside this box")
+    parser.add_argument('-a', '--averaged',
+                        default=False,
+                        action="store_true",
+                        help="files are time-averaged (3-day, weekly, "
+                             "monthly) products, default=False")
+    parser.add_argument('-p', '--processes',
+                        type=int,
+                        default=None,
+                        help="worker processes, default=number of CPUs")
+    parser.add_argument('-c', '--complevel',
+                        type=int,
+                        default=4,
+                        help="zlib compression level, default=4")
+
+    args = parser.parse_args(arglist)
+
+    return args
+
+
+def main(argv=None):
+    if argv is None:
+        argv = sys.argv
+
+    args = parse_args(argv[1:])
+    dataset = QuikScatAveraged if args.averaged else QuikScatDaily
+    nfiles = tonetcdf(args.filenames, args.ncfile, variables=args.variables,
+                      bbox=args.bbox, dataset=dataset,
+                      complevel=args.complevel, processes=args.processes)
+    print("Appended %d file(s) to %s" % (nfiles, args.ncfile))
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
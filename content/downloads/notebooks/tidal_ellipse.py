@@ -36,10 +36,21 @@ major axis convention.
 
 """
 
+import os
+import sys
+import json
+import time
+import argparse
+import tracemalloc
+import multiprocessing
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
 import numpy as np
 import matplotlib.pyplot as plt
+from matplotlib.collections import LineCollection
 
-def ap2ep(Au, PHIu, Av, PHIv, plot_demo=False):
+def ap2ep(Au, PHIu, Av, PHIv, plot_demo=False, return_w=True):
     """
     Convert tidal amplitude and phase lag (ap-) parameters into tidal ellipse
     (ep-) parameters. Please refer to ep2app for its inverse function.
@@ -47,6 +58,7 @@ def ap2ep(Au, PHIu, Av, PHIv, plot_demo=False):
     Usage:
 
     SEMA,  ECC, INC, PHA, w = ap2ep(Au, PHIu, Av, PHIv, plot_demo=False)
+    SEMA,  ECC, INC, PHA = ap2ep(Au, PHIu, Av, PHIv, return_w=False)
 
     Where:
 
@@ -82,6 +94,9 @@ def ap2ep(Au, PHIu, Av, PHIv, plot_demo=False):
               example, plot(real(w(1,:)), imag(w(1,:))) will let you see the
               first ellipse. You may need to use squeeze function when w is a
               more than two dimensional array. See example.py.
+              It is as large as the inputs (and complex), so pass
+              return_w=False to skip it when only the ep-parameters are
+              needed. See also ap2ep_chunked for bounded memory use.
 
     Document:   tidal_ellipse.ps
 
@@ -138,6 +153,19 @@ def ap2ep(Au, PHIu, Av, PHIv, plot_demo=False):
     """
 
 
+    SEMA, ECC, INC, PHA, wp, wm = _ap2ep(Au, PHIu, Av, PHIv)
+
+    if plot_demo:
+        plot_ell(SEMA, ECC, INC, PHA, plot_demo)
+
+    if not return_w:
+        return SEMA, ECC, INC, PHA
+
+    return SEMA, ECC, INC, PHA, _trace(wp, wm)
+
+def _ap2ep(Au, PHIu, Av, PHIv):
+    """ Child function of ap2ep, returns SEMA, ECC, INC, PHA, wp and wm """
+
     # Assume the input phase lags are in degrees and convert them in radians.
     PHIu = PHIu / 180 * np.pi
     PHIv = PHIv / 180 * np.pi
@@ -185,22 +213,31 @@ def ap2ep(Au, PHIu, Av, PHIv, plot_demo=False):
     PHA = PHA + k * 180
     PHA = np.mod(PHA, 360)
 
-    if plot_demo:
-        plot_ell(SEMA, ECC, INC, PHA, plot_demo)
+    return SEMA, ECC, INC, PHA, wp, wm
 
-    ndot = np.prod(np.shape(SEMA))
-    dot = 2 * np.pi / ndot
-    ot = np.arange(0, 2 * np.pi, dot)
-    w = wp.flatten() * np.exp(i * ot) + wm.flatten() * np.exp(-i * ot)
-    w = np.reshape(w, np.shape(wp))
+def ap2ep_chunked(Au, PHIu, Av, PHIv, out=None, chunksize=65536):
+    """
+    Same as ap2ep(Au, PHIu, Av, PHIv, return_w=False), but in bounded
+    memory: the (broadcast) inputs are converted chunksize elements at a
+    time and the results are written into out.
+
+    out is an optional tuple of four arrays (SEMA, ECC, INC, PHA) with the
+    broadcast shape of the inputs; they may be the inputs themselves for an
+    in-place conversion. By default new arrays are made, of the input type
+    for float32 inputs and float64 otherwise. Computations are done in the
+    input type, so float32 inputs never make float64 temporaries.
 
-    return SEMA, ECC, INC, PHA, w
+    Returns out.
 
-def ep2ap(SEMA, ECC, INC, PHA, plot_demo=False):
+    """
+
+    return _chunked(_ap2ep, (Au, PHIu, Av, PHIv), out, chunksize)
+
+def ep2ap(SEMA, ECC, INC, PHA, plot_demo=False, return_w=True):
     """
     Convert tidal ellipse parameters into amplitude and phase lag parameters.
     Its inverse is app2ep.m. Please refer to app2ep for the meaning of the
-    inputs and outputs.
+    inputs and outputs (including return_w).
 
     Zhigang Xu
     Oct. 20, 2000
@@ -237,6 +274,19 @@ def ep2ap(SEMA, ECC, INC, PHA, plot_demo=False):
 
     """
 
+    Au, PHIu, Av, PHIv, wp, wm = _ep2ap(SEMA, ECC, INC, PHA)
+
+    if plot_demo:
+        plot_ell(SEMA,ECC,INC,PHA,plot_demo);
+
+    if not return_w:
+        return Au, PHIu, Av, PHIv
+
+    return Au, PHIu, Av, PHIv, _trace(wp, wm)
+
+def _ep2ap(SEMA, ECC, INC, PHA):
+    """ Child function of ep2ap, returns Au, PHIu, Av, PHIv, wp and wm """
+
     i = 1j
 
     Wp = (1 + ECC) / 2 * SEMA
@@ -252,12 +302,6 @@ def ep2ap(SEMA, ECC, INC, PHA, plot_demo=False):
     wp = Wp * np.exp(i * THETAp)
     wm = Wm * np.exp(i * THETAm)
 
-    ndot = np.prod(np.shape(SEMA))
-    dot = 2 * np.pi / ndot
-    ot = np.arange(0, 2 * np.pi, dot)
-    w = wp.flatten() * np.exp(i * ot) + wm.flatten() * np.exp(-i * ot)
-    w = np.reshape(w, np.shape(wp))
-
     # Calculate cAu, cAv --- complex amplitude of u and v
     cAu = wp + np.conj(wm)
     cAv = -i * (wp-np.conj(wm))
@@ -267,15 +311,176 @@ def ep2ap(SEMA, ECC, INC, PHA, plot_demo=False):
     PHIv = -np.angle(cAv) * 180 / np.pi
 
     # flip angles in the range of [-180 0) to the range of [180 360).
-    id = PHIu < 0
-    PHIu[id] = PHIu[id] + 360
-    id = PHIv < 0
-    PHIv[id] = PHIv[id] + 360
+    PHIu = np.where(PHIu < 0, PHIu + 360, PHIu)
+    PHIv = np.where(PHIv < 0, PHIv + 360, PHIv)
 
-    if plot_demo:
-        plot_ell(SEMA,ECC,INC,PHA,plot_demo);
+    return Au, PHIu, Av, PHIv, wp, wm
+
+def ep2ap_chunked(SEMA, ECC, INC, PHA, out=None, chunksize=65536):
+    """
+    Same as ep2ap(SEMA, ECC, INC, PHA, return_w=False), in bounded memory.
+    See ap2ep_chunked for the meaning of out and chunksize.
+
+    """
+
+    return _chunked(_ep2ap, (SEMA, ECC, INC, PHA), out, chunksize)
 
-    return Au, PHIu, Av, PHIv, w
+def ap2ep_parallel(Au, PHIu, Av, PHIv, out=None, chunksize=65536,
+                   workers=None, processes=False):
+    """
+    Same as ap2ep_chunked, but the chunks are converted by a pool of
+    workers (default os.cpu_count()). Results match the serial ap2ep
+    bit-for-bit, whatever the number of workers.
+
+    Threads (the default) work directly on the inputs and out, since the
+    NumPy ufuncs release the GIL. With processes=True the chunks are sent
+    to a multiprocessing pool instead and the results written into out by
+    the calling process, with copies of at most 16 chunks per worker in
+    flight; scripts using it need the usual
+    "if __name__ == '__main__':" guard.
+
+    """
+
+    return _parallel(_ap2ep, (Au, PHIu, Av, PHIv), out, chunksize, workers,
+                     processes)
+
+def ep2ap_parallel(SEMA, ECC, INC, PHA, out=None, chunksize=65536,
+                   workers=None, processes=False):
+    """
+    Same as ep2ap_chunked, with a pool of workers. See ap2ep_parallel.
+
+    """
+
+    return _parallel(_ep2ap, (SEMA, ECC, INC, PHA), out, chunksize, workers,
+                     processes)
+
+def _iterator(args, out, chunksize):
+    """
+    Return an iterator over args and out (allocated if None) which
+    broadcasts the inputs, hands out contiguous chunks of at most chunksize
+    elements, writes the outputs back, and can be split into ranges.
+
+    """
+
+    args = [np.asanyarray(arg) for arg in args]
+    if out is None:
+        shape = np.broadcast_shapes(*[arg.shape for arg in args])
+        dtype = np.result_type(*args + [np.float32])
+        out = tuple(np.empty(shape, dtype=dtype) for k in range(4))
+    elif len(out) != 4:
+        raise ValueError('out must be a tuple of four arrays')
+
+    flags = ['external_loop', 'buffered', 'ranged', 'zerosize_ok']
+    op_flags = [['readonly']] * len(args) + [['writeonly']] * 4
+    return np.nditer(args + list(out), flags=flags, op_flags=op_flags,
+                     buffersize=chunksize, casting='same_kind')
+
+def _chunked(func, args, out, chunksize):
+    """ Apply func (_ap2ep or _ep2ap) to args chunk by chunk into out """
+
+    it = _iterator(args, out, chunksize)
+    with it:
+        _convert(func, it, len(args))
+        return it.operands[len(args):]
+
+def _convert(func, it, nargs):
+    """ Run func over (the range of) iterator it """
+
+    for chunk in it:
+        results = func(*chunk[:nargs])
+        for o, r in zip(chunk[nargs:], results):
+            o[...] = r
+
+def _parallel(func, args, out, chunksize, workers, processes):
+    """ Apply func to args into out with a pool of workers """
+
+    workers = workers or os.cpu_count() or 1
+    nargs = len(args)
+    it = _iterator(args, out, chunksize)
+    with it:
+        # A few ranges per worker balance the load; each range is a whole
+        # number of chunks.
+        size = it.itersize
+        nchunks = -(-size // chunksize)
+        step = max(1, -(-nchunks // (4 * workers))) * chunksize
+        if processes:
+            # Ranges sent to processes are copied: keep them small.
+            step = min(step, 8 * chunksize)
+        ranges = [(start, min(start + step, size))
+                  for start in range(0, size, step)]
+
+        if processes:
+            pool = multiprocessing.Pool(workers)
+            try:
+                # Copies of the inputs of at most two ranges per worker are
+                # queued at a time, so memory does not grow with size.
+                pending = deque()
+                for r in ranges:
+                    if len(pending) == 2 * workers:
+                        done, result = pending.popleft()
+                        _write(it, done, nargs, result.get())
+                    task = (func, _read(it, r, nargs))
+                    pending.append((r, pool.apply_async(_convert_chunks,
+                                                        (task,))))
+                while pending:
+                    done, result = pending.popleft()
+                    _write(it, done, nargs, result.get())
+            finally:
+                pool.close()
+                pool.join()
+        else:
+            def convert(r):
+                sub = it.copy()
+                sub.iterrange = r
+                with sub:
+                    _convert(func, sub, nargs)
+
+            with ThreadPoolExecutor(workers) as executor:
+                list(executor.map(convert, ranges))
+
+        return it.operands[nargs:]
+
+def _convert_chunks(task):
+    """ Process pool worker: apply func to a list of chunks of inputs """
+
+    func, chunks = task
+    return [func(*chunk)[:4] for chunk in chunks]
+
+def _read(it, r, nargs):
+    """ Return copies of the input chunks in range r of iterator it """
+
+    sub = it.copy()
+    sub.iterrange = r
+    with sub:
+        return [[x.copy() for x in chunk[:nargs]] for chunk in sub]
+
+def _write(it, r, nargs, results):
+    """ Write results, chunk by chunk, into range r of iterator it """
+
+    sub = it.copy()
+    sub.iterrange = r
+    with sub:
+        for chunk, result in zip(sub, results):
+            for o, x in zip(chunk[nargs:], result):
+                o[...] = x
+
+def _trace(wp, wm):
+    """
+    Return w, one point of the trace of each ellipse (see ap2ep), from the
+    complex radii of the anticlockwise and clockwise circles.
+
+    """
+
+    i = 1j
+
+    ndot = np.prod(np.shape(wp))
+    dot = 2 * np.pi / ndot
+    # Same as np.arange(0, 2 * np.pi, dot), which may give ndot + 1 points.
+    ot = np.arange(ndot) * dot
+    w = wp.flatten() * np.exp(i * ot) + wm.flatten() * np.exp(-i * ot)
+    w = np.reshape(w, np.shape(wp))
+
+    return w
 
 def cBEpm(g, f, sigma, nu, kappa, z, h):
     """
@@ -295,11 +500,14 @@ def cBEpm(g, f, sigma, nu, kappa, z, h):
                 within [0 -h];
         h:      the water depth, must be positive.
 
-        Note: except for z, all other inputs must be scalars.
+        Note: all inputs may be arrays; they are broadcast against each
+        other, so that e.g. a whole grid of nu, kappa and h is evaluated
+        at once.
 
     Outputs:
 
-        BEp and BEm, the same dimensions of z,  the outputs for the vertical
+        BEp and BEm, the broadcast dimensions of the inputs (those of z when
+            all other inputs are scalars),  the outputs for the vertical
             velocity profiles driven respectively by a unit of sea surface
             slope in the positive rotation direction and negative rotation
             direction for when the eddy viscosity is vertically invariant. See
@@ -336,17 +544,17 @@ def cBEpm(g, f, sigma, nu, kappa, z, h):
 
     """
 
-    if (len(g)>1) | (len(f)>1) | (len(sigma)>1) | \
-            (len(nu)>1) | (len(kappa)>1) | (len(h)>1):
-        print('inputs of g, f, sigma, nu, kappa, and h should be all scalars!')
-        raise
-
-    if (any(z / h > 0)) | (any(z / h < -1)):
+    z = np.asanyarray(z)
+    h = np.asanyarray(h)
+    if np.any(z / h > 0) | np.any(z / h < -1):
         print('z must be negative and must be within [0 -h]')
 
+    i = 1j
+
+    # The square roots are complex when sigma > f, as in MATLAB.
     delta_e = np.sqrt(2 *nu / f) # Ekman depth
-    alpha = (1 + i) / delta_e * np.sqrt(1 + sigma / f)
-    beta  = (1 + i) / delta_e * np.sqrt(1 - sigma / f)
+    alpha = (1 + i) / delta_e * np.sqrt(1 + sigma / f + 0j)
+    beta  = (1 + i) / delta_e * np.sqrt(1 - sigma / f + 0j)
 
     BEp = get_BE(g, alpha, h, z, nu, kappa)
     BEm = get_BE(g, beta,  h, z,  nu, kappa)
@@ -354,45 +562,67 @@ def cBEpm(g, f, sigma, nu, kappa, z, h):
     return BEp, BEm
 
 def get_BE(g, alpha, h, z, nu, kappa):
-    """ Child function of cBEpm """
+    """
+    Child function of cBEpm, broadcasting all inputs. Each element uses the
+    series solution where abs(alpha * h) < 1, and the finite solution
+    elsewhere.
+
+    """
+
+    g, alpha, h, z, nu, kappa = np.broadcast_arrays(g, alpha, h, z, nu,
+                                                    kappa)
+    # BE is even in alpha, so take real(alpha * h) >= 0: then all the
+    # exponentials below decay and stay finite however large alpha * h is.
+    alpha = np.where((alpha * h).real < 0, -alpha, alpha)
+
+    BE = np.empty(alpha.shape, dtype=complex)
+    series = np.abs(alpha * h) < 1
+    for where, solution in ((series, _BE_series), (~series, _BE_finite)):
+        if where.any():
+            BE[where] = solution(*[x[where] for x in
+                                   (g, alpha, h, z, nu, kappa)])
+
+    return BE[()]
+
+def _BE_series(g, alpha, h, z, nu, kappa):
+    """ Series solution of get_BE, for abs(alpha * h) < 1 """
 
-    z     = z.flatten()
     z_h   = z / h
     ah    = alpha * h
-    az    = alpha * z
     ah2   = ah * 2
     anu_k = alpha * nu / kappa
     nu_kh = nu / (kappa * h)
 
-    # Series solution
-    if abs(ah) < 1:
-        T = 10
-        C = -g * h * h / (nu * (1 + anu_k * np.tanh(ah))) * 2
-        A1 = (1 - z_h * z_h) / 2 + nu_kh
-        B1 = np.exp(-ah) / (1 + np.exp(-ah2))
-        B  = B1
-        series_sum = A1 * B1
+    T = 10
+    C = -g * h * h / (nu * (1 + anu_k * np.tanh(ah))) * 2
+    A1 = (1 - z_h * z_h) / 2 + nu_kh
+    B1 = np.exp(-ah) / (1 + np.exp(-ah2))
+    B  = B1
+    series_sum = A1 * B1
 
-        for t in np.arange(2, T):
-            t2 = 2*t
-            A = (1 - z_h**t2) / t2 + nu_kh
-            B = B * ah * ah / (t2 - 1) / (t2 - 2)
-            series_sum = series_sum + A * B
+    for t in np.arange(2, T):
+        t2 = 2*t
+        A = (1 - z_h**t2) / t2 + nu_kh
+        B = B * ah * ah / (t2 - 1) / (t2 - 2)
+        series_sum = series_sum + A * B
 
-        BE = C*series_sum
+    return C*series_sum
 
-    # Finite solution
-    else:
-        c = -g * h * h / nu
-        denom = (np.exp(az - ah) + np.exp(-(az + ah))) / (1 + np.exp(-2 * ah))
-            # = cosh(az)/cosh(ah)
-            # but this a better way to evaluate it.
+def _BE_finite(g, alpha, h, z, nu, kappa):
+    """ Finite solution of get_BE, for abs(alpha * h) >= 1 """
 
-        numer = 1 + anu_k * np.tanh(ah)
-        # BE=c * (1 - denom / numer)
-        BE = c * ((1 - denom / numer) / (ah * ah))
+    ah    = alpha * h
+    az    = alpha * z
+    anu_k = alpha * nu / kappa
+
+    c = -g * h * h / nu
+    denom = (np.exp(az - ah) + np.exp(-(az + ah))) / (1 + np.exp(-2 * ah))
+        # = cosh(az)/cosh(ah)
+        # but this a better way to evaluate it.
 
-    return BE
+    numer = 1 + anu_k * np.tanh(ah)
+    # BE=c * (1 - denom / numer)
+    return c * ((1 - denom / numer) / (ah * ah))
 
 def sub2ind(shape, pos):
     """
@@ -406,13 +636,7 @@ def sub2ind(shape, pos):
     From http://stackoverflow.com/questions/4114461
 
     """
-    res = 0
-    acc = 1
-    for pi, si in zip(reversed(pos), reversed(shape)):
-        res += pi * acc
-        acc *= si
-
-    return res
+    return int(np.ravel_multi_index(tuple(pos), shape))
 
 def plot_ell(SEMA, ECC, INC, PHA, IND=[1]):
     """
@@ -427,51 +651,93 @@ def plot_ell(SEMA, ECC, INC, PHA, IND=[1]):
 
     """
 
-    size_SEMA=np.shape(SEMA)
+    if not len(IND):
+        print('IND input contains zero element(s)!\n'
+              'No ellipse will be plotted.')
+        return
 
-    len_IND = len(IND)
-    if IND:
-        cmd = 'sub2ind(size_SEMA, '
-        if len_IND == 1:
-            titletxt = 'Ellipse '
-        else:
-            titletxt = 'Ellipse ('
-
-        for k in range(len_IND):
-            if k == 0:
-                cmd = cmd + '[' + str(IND[k])
-            else:
-                cmd = cmd + ',' + str(IND[k])
-
-            if k < len_IND-1:
-                titletxt = titletxt + str(IND[k]) + ','
-            elif len_IND == 1:
-                titletxt = titletxt + str(IND[k])
-            else:
-                titletxt = titletxt + str(IND[k]) + ')'
-
-        cmd = 'n = ' + cmd + '])'
-        exec(cmd)
-
-        plt.gcf()
-        plt.clf()
-        do_the_plot(SEMA.flatten()[n], ECC.flatten()[n], INC.flatten()[n], PHA.flatten()[n])
-        titletxt = titletxt + ',  (red) green (anti-) clockwise component'
-        plt.title(titletxt)
-    elif len_IND:
-        print('IND input contains zero element(s)!\nNo ellipse will be plotted.')
+    # A single index is a linear (flat) index, as in MATLAB.
+    if len(IND) == 1:
+        n = IND[0]
+        titletxt = 'Ellipse ' + str(IND[0])
+    else:
+        n = np.ravel_multi_index(tuple(IND), np.shape(SEMA))
+        titletxt = 'Ellipse (' + ','.join(str(k) for k in IND) + ')'
+
+    plt.gcf()
+    plt.clf()
+    do_the_plot(SEMA.flatten()[n], ECC.flatten()[n], INC.flatten()[n],
+                PHA.flatten()[n])
+    titletxt = titletxt + ',  (red) green (anti-) clockwise component'
+    plt.title(titletxt)
 
 def do_the_plot(SEMA, ECC, INC, PHA):
     """
     Ellipse plot subfunction.
 
+    Each component (the ellipse, the anticlockwise and clockwise circles,
+    and the axes) is drawn with a single artist.
+
     Converted to Python by Pierre Cazenave, October 2012.
 
     """
 
+    w, wmin, wmax = prep_plot(SEMA, ECC, INC, PHA)
+    a, b = _rotary(SEMA, ECC, INC, PHA)
+    w = w[:-1]
+
+    ax = plt.gca()
+    ax.plot(np.real(w), np.imag(w), 'b-o')
+    ax.plot(np.real(a), np.imag(a), 'r-o')
+    ax.plot(np.real(b), np.imag(b), 'g-o')
+    ax.plot(0, 0, 'bo')
+    ax.add_collection(LineCollection(_segments([0, wmax], [0, wmin]),
+                                     colors='m'))
+    ab = a[0] + b[0]
+    ax.add_collection(LineCollection(_segments([a[0], ab], [b[0], ab]),
+                                     colors=['g', 'r'], linestyles='--'))
+    ax.axis('equal')
+    ax.set_xlabel('u')
+    ax.set_ylabel('v')
+
+    plt.show()
+
+def plot_ellipses(w, x=0, y=0, scale=1, ax=None, **kwargs):
+    """
+    Plot many ellipses at once, e.g. for a map of the ellipses over a whole
+    model domain.
+
+    w is the first output of prep_plot for arrays of SEMA, ECC, INC and PHA,
+    x and y are the centres of the ellipses (broadcast against w.shape[:-1])
+    and scale multiplies the velocities into the units of x and y. Further
+    keyword arguments are passed to LineCollection.
+
+    Returns the LineCollection, added to ax (default the current axes).
+
+    """
+
+    centre = np.asanyarray(x) + 1j * np.asanyarray(y)
+    w = np.asanyarray(w) * scale + centre[..., np.newaxis]
+    segments = np.stack((np.real(w), np.imag(w)), axis=-1)
+    segments = segments.reshape(-1, w.shape[-1], 2)
+
+    if ax is None:
+        ax = plt.gca()
+    collection = LineCollection(segments, **kwargs)
+    ax.add_collection(collection)
+    ax.autoscale_view()
+
+    return collection
+
+def _rotary(SEMA, ECC, INC, PHA, dot=np.pi / 36):
+    """
+    Return the anticlockwise and clockwise rotating components of the
+    ellipses along their last axis (see do_the_plot).
+
+    """
+
     i = 1j
 
-    SEMI = SEMA * ECC
     Wp = (1 + ECC) / 2 * SEMA
     Wm = (1 - ECC) / 2 * SEMA
     THETAp = INC - PHA
@@ -480,48 +746,21 @@ def do_the_plot(SEMA, ECC, INC, PHA):
     # Convert degrees into radians
     THETAp = THETAp / 180 * np.pi
     THETAm = THETAm / 180 * np.pi
-    INC = INC / 180 * np.pi
-    PHA = PHA / 180 * np.pi
 
     # Calculate wp and wm.
-    wp = Wp * np.exp(i * THETAp)
-    wm = Wm * np.exp(i * THETAm)
+    wp = np.asanyarray(Wp * np.exp(i * THETAp))[..., np.newaxis]
+    wm = np.asanyarray(Wm * np.exp(i * THETAm))[..., np.newaxis]
 
-    dot = np.pi / 36
     ot = np.arange(0, 2 * np.pi, dot)
     a = wp * np.exp(i * ot)
     b = wm * np.exp(-i * ot)
-    w = a + b
 
-    wmax = SEMA * np.exp(i * INC)
-    wmin = SEMI * np.exp(i * (INC + np.pi / 2))
+    return a, b
 
-    plt.plot(np.real(w), np.imag(w))
-    plt.axis('equal')
-    plt.hold('on')
-    plt.plot([0, np.real(wmax)], [0, np.imag(wmax)], 'm')
-    plt.plot([0, np.real(wmin)], [0, np.imag(wmin)], 'm')
-    plt.xlabel('u')
-    plt.ylabel('v')
-    plt.plot(np.real(a), np.imag(a), 'r')
-    plt.plot(np.real(b), np.imag(b), 'g')
-    hnd_a = plt.plot([0, np.real(a[0])], [0, np.imag(a[0])], 'ro')
-    hnd_b = plt.plot([0, np.real(b[0])], [0, np.imag(b[0])], 'go')
-    hnd_w = plt.plot([0, np.real(w[0])], [0, np.imag(w[0])], 'bo')
-    plt.plot(np.real(a[0]), np.imag(a[0]), 'ro')
-    plt.plot(np.real(b[0]), np.imag(b[0]), 'go')
-    plt.plot(np.real(w[0]), np.imag(w[0]), 'bo')
-    hnd_ab=plt.plot(np.real([a[0], a[0]+b[0]]), np.imag([a[0], a[0]+b[0]]), linestyle='--', color='g')
-    hnd_ba=plt.plot(np.real([b[0], a[0]+b[0]]), np.imag([b[0], a[0]+b[0]]), linestyle='--', color='r')
-
-    for n in range(len(ot)):
-        plt.hold('on')
-        plt.plot(np.real(a[n]), np.imag(a[n]), 'ro')
-        plt.plot(np.real(b[n]), np.imag(b[n]), 'go')
-        plt.plot(np.real(w[n]), np.imag(w[n]), 'bo')
-
-    plt.hold('off')
-    plt.show()
+def _segments(*lines):
+    """ Return LineCollection segments of lines of complex points """
+
+    return [[(np.real(p), np.imag(p)) for p in line] for line in lines]
 
 def prep_plot(SEMA, ECC, INC, PHA):
     """
@@ -533,36 +772,22 @@ def prep_plot(SEMA, ECC, INC, PHA):
     required.
 
     Returns w, wmin and wmax (w is used for plotting the ellipse, see
-    plot_ell).
+    plot_ell). The inputs may be arrays, in which case the points of each
+    ellipse are along the last axis of w (see plot_ellipses).
 
     """
 
     i = 1j
 
     SEMI = SEMA * ECC
-    Wp = (1 + ECC) / 2 * SEMA
-    Wm = (1 - ECC) / 2 * SEMA
-    THETAp = INC - PHA
-    THETAm = INC + PHA
-
-    # Convert degrees into radians
-    THETAp = THETAp / 180 * np.pi
-    THETAm = THETAm / 180 * np.pi
-    INC = INC / 180 * np.pi
-    PHA = PHA / 180 * np.pi
-
-    # Calculate wp and wm.
-    wp = Wp * np.exp(i * THETAp)
-    wm = Wm * np.exp(i * THETAm)
-
-    dot = np.pi / 36
-    ot = np.arange(0, 2 * np.pi, dot)
-    a = wp * np.exp(i * ot)
-    b = wm * np.exp(-i * ot)
+    a, b = _rotary(SEMA, ECC, INC, PHA)
     w = a + b
 
     # Repeat the first position in w so we close the ellipse.
-    w = np.hstack((w, w[0]))
+    w = np.concatenate((w, w[..., :1]), axis=-1)
+
+    # Convert degrees into radians
+    INC = INC / 180 * np.pi
 
     wmax = SEMA * np.exp(i * INC)
     wmin = SEMI * np.exp(i * (INC + np.pi / 2))
@@ -570,8 +795,7 @@ def prep_plot(SEMA, ECC, INC, PHA):
     return w, wmin, wmax
 
 
-if __name__ == '__main__':
-
+def demo():
     """
     Replicate the tidal ellipse example file from Zhigang Xu's tidal_ellipse
     MATLAB toolbox.
@@ -588,10 +812,11 @@ if __name__ == '__main__':
 
     plt.figure(1)
     plt.clf()
-    SEMA, ECC, INC, PHA, w = ap2ep(Au, Phi_u, Av, Phi_v, [2, 3, 1])
+    # Zhigang Xu's [2, 3, 1] in MATLAB's one-based indices.
+    SEMA, ECC, INC, PHA, w = ap2ep(Au, Phi_u, Av, Phi_v, [1, 2, 0])
     plt.figure(2)
     plt.clf()
-    rAu, rPhi_u, rAv, rPhi_v, rw = ep2ap(SEMA, ECC, INC, PHA, [2, 3, 1])
+    rAu, rPhi_u, rAv, rPhi_v, rw = ep2ap(SEMA, ECC, INC, PHA, [1, 2, 0])
 
     # Check if ep2ap has recovered Au, Phi_u, Av, Phi_v
     print(np.max(np.abs(rAu - Au).flatten()))       #  = 9.9920e-16, = 2.22044604925e-16
@@ -608,3 +833,140 @@ if __name__ == '__main__':
     # Pierre Cazenave
     # October, 2012
 
+
+# Round-trip (ap2ep -> ep2ap) tolerances, from the differences listed in the
+# demo with some headroom. Phase errors grow as the amplitude shrinks, so
+# they are weighted by the amplitude (degrees times amplitude).
+TOLERANCES = dict(Au=1e-14, Av=1e-14, Phi_u=1e-12, Phi_v=1e-12, w=1e-14)
+
+def round_trip(size, seed=None):
+    """
+    Return the maximum round-trip errors of ap2ep -> ep2ap for size random
+    ellipses, raising AssertionError if any exceeds TOLERANCES.
+
+    """
+
+    rng = np.random.default_rng(seed)
+    Au, Av = rng.random((2, size))
+    Phi_u, Phi_v = rng.random((2, size)) * 360
+
+    SEMA, ECC, INC, PHA, w = ap2ep(Au, Phi_u, Av, Phi_v)
+    rAu, rPhi_u, rAv, rPhi_v, rw = ep2ap(SEMA, ECC, INC, PHA)
+
+    def phase(r, p, A):
+        # Differences across 0/360 are tiny, not 360.
+        return np.max(np.abs((r - p + 180) % 360 - 180) * A)
+
+    errors = dict(Au=np.max(np.abs(rAu - Au)),
+                  Av=np.max(np.abs(rAv - Av)),
+                  Phi_u=phase(rPhi_u, Phi_u, Au),
+                  Phi_v=phase(rPhi_v, Phi_v, Av),
+                  w=np.max(np.abs(w - rw)))
+    errors = dict((k, float(v)) for k, v in errors.items())
+
+    for k, v in errors.items():
+        if not v <= TOLERANCES[k]:
+            raise AssertionError('Round-trip error of %s for %d ellipses: '
+                                 '%g > %g' % (k, size, v, TOLERANCES[k]))
+
+    return errors
+
+def benchmark(sizes=None, repeat=3, seed=None):
+    """
+    Time ap2ep, ep2ap, prep_plot and cBEpm over sizes (default 10**2 to
+    10**7 elements) and check the round trip at each size.
+
+    Returns a list of dictionaries (one per function and size) with the
+    best time in seconds of repeat runs, the elements per second and the
+    peak memory in bytes traced during a run. For prep_plot, size is the
+    number of plotted points (73 per ellipse).
+
+    """
+
+    if sizes is None:
+        sizes = [10**k for k in range(2, 8)]
+
+    results = []
+    for size in sizes:
+        rng = np.random.default_rng(seed)
+        Au, Av = rng.random((2, size))
+        Phi_u, Phi_v = rng.random((2, size)) * 360
+        SEMA, ECC, INC, PHA = ap2ep(Au, Phi_u, Av, Phi_v, return_w=False)
+        n = max(1, size // 73)
+        z = -rng.random(size) * 50
+        cases = [
+            ('ap2ep', lambda: ap2ep(Au, Phi_u, Av, Phi_v)),
+            ('ep2ap', lambda: ep2ap(SEMA, ECC, INC, PHA)),
+            ('prep_plot', lambda: prep_plot(SEMA[:n], ECC[:n], INC[:n],
+                                            PHA[:n])),
+            ('cBEpm', lambda: cBEpm(9.81, 1e-4, 1.4e-4, 1e-2, 1e-2, z,
+                                    50.)),
+        ]
+        for name, func in cases:
+            seconds, peak = _measure(func, repeat)
+            results.append(dict(function=name, size=size, seconds=seconds,
+                                per_second=size / seconds, peak_bytes=peak))
+        errors = round_trip(size, seed=seed)
+        results.append(dict(function='round_trip', size=size, **errors))
+
+    return results
+
+def _measure(func, repeat):
+    """ Return the best time of repeat calls of func and its peak memory """
+
+    best = np.inf
+    peak = 0
+    for k in range(repeat):
+        tracemalloc.start()
+        try:
+            start = time.perf_counter()
+            func()
+            best = min(best, time.perf_counter() - start)
+            peak = max(peak, tracemalloc.get_traced_memory()[1])
+        finally:
+            tracemalloc.stop()
+
+    return best, peak
+
+def parse_args(arglist):
+    """ Parse the command line arguments """
+
+    parser = argparse.ArgumentParser(
+        description='Benchmark the tidal ellipse tools and check the '
+                    'ap2ep -> ep2ap round trip, printing one JSON '
+                    'record per line.')
+    parser.add_argument('-s', '--sizes', type=int, nargs='+',
+                        help='numbers of elements (default 10**2 to 10**7)')
+    parser.add_argument('-r', '--repeat', type=int, default=3,
+                        help='runs per function and size (default 3)')
+    parser.add_argument('--seed', type=int, default=None,
+                        help='seed of the random inputs')
+    parser.add_argument('--demo', action='store_true',
+                        help="plot Zhigang Xu's ap2ep/ep2ap demo instead")
+
+    return parser.parse_args(arglist)
+
+def main(argv=None):
+    """ Run the benchmark suite (or the demo) """
+
+    if argv is None:
+        argv = sys.argv
+    args = parse_args(argv[1:])
+
+    if args.demo:
+        demo()
+        return 0
+
+    try:
+        for record in benchmark(args.sizes, args.repeat, args.seed):
+            print(json.dumps(record))
+            sys.stdout.flush()
+    except AssertionError as e:
+        sys.stderr.write('%s\n' % e)
+        return 1
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))